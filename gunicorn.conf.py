@@ -0,0 +1,60 @@
+# gunicorn.conf.py -- production entry point:
+#   gunicorn rag_backend.wsgi:application
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+# each worker has its own in-process caches; the query cache checks
+# db/index.gen on every lookup, so an ingest or clear on one worker (or by
+# main.py) is seen by the others; /clear/ idempotency keys live in
+# db/clear_tokens/ so a retried clear is deduplicated across workers
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+# threaded workers: a request blocked on Qdrant I/O or on the LLM lock
+# releases the GIL and only holds one of the worker's threads, so one
+# process serves many requests at once (and QueryBatcher can coalesce them).
+# DRF views are sync-only; under ASGI they would all be funneled through
+# asgiref's single sync thread, which is worse than this
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+timeout = 120  # LLM generation can take a while
+
+# import Django and rag once in the master, then fork: read-only pages
+# (code, mmap'd index, CPU embedding weights) are shared copy-on-write
+preload_app = True
+
+
+def _preload_enabled() -> bool:
+    return os.getenv("RAG_PRELOAD", "1").lower() in ("1", "true", "yes")
+
+
+def when_ready(server):
+    # runs in the master before workers are forked; warm the shared
+    # service so workers don't each load the index on their first request.
+    # The model is only loaded here when it is pinned to the CPU: with
+    # EMBED_DEVICE=auto it may land on CUDA, and a CUDA context created in
+    # the master breaks every forked worker ("Cannot re-initialize CUDA in
+    # forked subprocess"), so post_fork loads it per worker instead
+    if not _preload_enabled():
+        return
+    import rag
+    from rag_api.views import _svc
+
+    svc = _svc()
+    svc._get_index()
+    # Qdrant collection setup (and RESET_ON_STARTUP) once for the server
+    # rather than once per worker; REST only, and the storage's session and
+    # gRPC client are per process, so no socket or channel crosses the fork
+    rag._use_qdrant()
+    if rag.EMBED_DEVICE == "cpu":
+        svc._load_embedding_model()
+    server.log.info("RAG service preloaded")
+
+
+def post_fork(server, worker):
+    # in the worker, after fork: now it is safe to pick (and init) a GPU
+    if not _preload_enabled():
+        return
+    import rag
+    from rag_api.views import _svc
+
+    if rag.EMBED_DEVICE != "cpu":
+        _svc()._load_embedding_model()
@@ -1,65 +1,167 @@
-# rag.py (RAGService Class using NumPy/Sklearn)
+# rag.py (RAGService Class using NumPy)
 from __future__ import annotations
-import glob, json, os, re, sys, uuid
+import atexit, glob, hashlib, json, multiprocessing, os, queue, re, sys, threading, time, uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
 from typing import Any, List, Tuple, Dict
 import numpy as np
-from pypdf import PdfReader
-
-# from sklearn.neighbors import NearestNeighbors
+from filelock import FileLock
+from rag_pdf import extract_one as _extract_one
 from sentence_transformers import SentenceTransformer
 
+try:  # optional: JIT the chunk packing loop when numba is installed
+    from numba import njit as _njit
+except ImportError:
+    _njit = None
+
+try:  # optional: persisted HNSW index for sub-linear retrieval
+    import faiss
+except ImportError:
+    faiss = None
+
+try:  # optional: on-disk query-embedding cache shared by worker processes
+    import diskcache
+except ImportError:
+    diskcache = None
+
 # Configuration (remains global for now)
 EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
 DB_DIR = "db"
-TEXT_PATH = os.path.join(DB_DIR, "chunks.json")
-META_PATH = os.path.join(DB_DIR, "metas.json")
+# chunk texts: one UTF-8 blob plus an int64 offset table (chunk i is
+# blob[off[i]:off[i+1]]), both memory-mapped so retrieve reads only k slices
+TEXT_PATH = os.path.join(DB_DIR, "chunks.bin")
+TEXT_OFF_PATH = os.path.join(DB_DIR, "chunks.off.npy")
+# columnar metas for chunk i: doc_names[doc_codes[i]], chunk_idxs[i], and
+# id_tags[i], the random suffix of the "{doc_id}:{chunk_idx}:{tag}" chunk id
+META_PATH = os.path.join(DB_DIR, "metas.npz")
 EMB_PATH = os.path.join(DB_DIR, "embeddings.npy")
+# int8 (SQ8) copy of the embeddings + per-vector scale, used for the retrieve scan
+EMB_Q8_PATH = os.path.join(DB_DIR, "embeddings.q8.npy")
+EMB_SCALE_PATH = os.path.join(DB_DIR, "embeddings.scale.npy")
+# HNSW graph over the float32 embeddings (built at ingest when faiss is installed)
+HNSW_PATH = os.path.join(DB_DIR, "hnsw.bin")
+# held while writing the index files, across processes (API workers, main.py)
+INDEX_LOCK_PATH = os.path.join(DB_DIR, "index.lock")
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+QUANTIZE_INT8 = os.getenv("RAG_QUANTIZE", "int8").lower() == "int8"
+SCAN_BLOCK_ROWS = 4096  # rows dequantized per step in the int8 scan
+LLM_N_CTX = 4096
+# API micro-batching of concurrent queries (see QueryBatcher)
+QUERY_BATCH_MAX = 32
+QUERY_BATCH_WAIT_MS = 5.0
+QUERY_BATCH_TIMEOUT_S = 60.0  # a request waits this long for its batch
+# query cache: exact (sha256 of k + query) and semantic (cosine on query embedding)
+QCACHE_PATH = os.path.join(DB_DIR, "qcache.npz")
+# rewritten on every ingest/clear, by any process (API workers, main.py);
+# query caches compare its stat on each lookup and drop stale results
+INDEX_GEN_PATH = os.path.join(DB_DIR, "index.gen")
+QCACHE_SIZE = int(os.getenv("RAG_QCACHE_SIZE", "1024"))  # 0 disables the cache
+QCACHE_SIM_THRESHOLD = 0.97
+QCACHE_SAVE_EVERY = (
+    16  # persist (in the background) after this many writes, and at exit
+)
+QEMB_CACHE_SIZE = 4096  # query text -> embedding LRU (~6 MB at dim 384)
+# second tier behind it, on disk; survives restarts and is shared by the
+# API workers. "" disables it
+QEMB_DISK_PATH = os.getenv("RAG_QEMB_DISK", os.path.join(DB_DIR, "qemb"))
+QEMB_DISK_LIMIT = 256 << 20
+# "auto" picks cuda > mps > cpu; fp16 weights are used on CUDA only
+EMBED_DEVICE = os.getenv("EMBED_DEVICE", "auto").lower()
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH", "128"))  # texts per forward pass
+INGEST_BATCH = 512  # chunks encoded and flushed to the index per step
 DEFAULT_GPT4ALL_MODEL = "Llama-3.2-1B-Instruct-Q4_0.gguf"
+_COMPACT = (",", ":")  # json separators without the default padding spaces
+_SENT_RE = re.compile(r"(?<=[.!?。！？])\s+")
 USE_QDRANT = os.getenv("RAG_STORAGE", "memory").lower() == "qdrant"
-# switcher for Qdrant
-if USE_QDRANT:
-    try:
-        from rag_backend.storage_qdrant import QdrantStorage
+# switcher for Qdrant: the storage is built on first use, not at import,
+# so importing rag never touches the network (see _use_qdrant)
+_qdrant = None
+_QDRANT_LOCK = threading.Lock()
+
+
+def _use_qdrant() -> bool:
+    # True when Qdrant mode is on and its storage is up; a failed init falls
+    # back to the local index for the rest of the process
+    global USE_QDRANT, _qdrant
+    if USE_QDRANT and _qdrant is None:
+        with _QDRANT_LOCK:
+            if USE_QDRANT and _qdrant is None:
+                try:
+                    from rag_backend.storage_factory import get_storage
 
-        _qdrant = QdrantStorage()
-    except Exception as e:
-        print(f"[ERROR] Qdrant init failed: {e}", file=sys.stderr)
-        USE_QDRANT = False
+                    _qdrant = get_storage()  # same instance clear_storage() uses
+                except Exception as e:
+                    print(f"[ERROR] Qdrant init failed: {e}", file=sys.stderr)
+                    USE_QDRANT = False
+    return USE_QDRANT
 
 
 # Utility Functions (Chunking/Loading PDFs)
-def load_pdfs(paths: List[str]) -> List[Tuple[str, str]]:
-    docs = []
-    for p in paths:
-        try:
-            reader = PdfReader(p)
-            text = "\n".join((page.extract_text() or "") for page in reader.pages)
-            text = re.sub(r"\s+\n", "\n", text).strip()
-            docs.append((os.path.basename(p), text))
-        except Exception as e:
-            print(f"[WARN] Failed to read {p}: {e}", file=sys.stderr)
-    return docs
+# start method for the extraction pool: forking a process that already holds
+# CUDA / the embedding model / BLAS and gunicorn threads can deadlock the
+# child, so start workers clean (forkserver; spawn where it doesn't exist).
+# The children unpickle rag_pdf.extract_one, so they never import rag itself
+_POOL_CTX = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+def load_pdfs(
+    paths: List[str], blobs: List[Tuple[str, bytes]] = ()
+) -> List[Tuple[str, str]]:
+    # blobs: (name, pdf bytes) pairs parsed from memory alongside the paths.
+    # Extraction is CPU-bound, so fan files out across processes
+    names = list(paths) + [name for name, _ in blobs]
+    datas = [None] * len(paths) + [data for _, data in blobs]
+    if len(names) > 1:
+        workers = min(len(names), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_POOL_CTX) as ex:
+            results = list(ex.map(_extract_one, names, datas, chunksize=1))
+    else:
+        results = [_extract_one(n, d) for n, d in zip(names, datas)]
+    return [(doc_id, text) for doc_id, text in results if text is not None]
 
 
 def _simple_sentence_split(text: str) -> List[str]:
-    return [
-        s.strip() for s in re.split(r"(?<=[.!?。！？])\s+", text) if s and s.strip()
-    ]
+    return [s.strip() for s in _SENT_RE.split(text) if s and s.strip()]
 
 
-def chunk_text(text: str, max_words: int = 180) -> List[str]:
-    sents = _simple_sentence_split(text)
-    chunks, buf, count = [], [], 0
-    for s in sents:
-        w = len(s.split())
-        if count + w > max_words and buf:
-            chunks.append(" ".join(buf))
-            buf, count = [s], w
+def _greedy_pack(word_counts: np.ndarray, max_words: int) -> np.ndarray:
+    # returns chunk boundaries b so that chunk j is sents[b[j]:b[j+1]]
+    n = word_counts.shape[0]
+    bounds = np.empty(n + 1, dtype=np.int64)
+    bounds[0] = 0
+    m, start, count = 1, 0, 0
+    for i in range(n):
+        w = word_counts[i]
+        if count + w > max_words and i > start:
+            bounds[m] = i
+            m += 1
+            start, count = i, w
         else:
-            buf.append(s)
             count += w
-    if buf:
-        chunks.append(" ".join(buf))
+    bounds[m] = n
+    return bounds[: m + 1]
+
+
+if _njit is not None:
+    _greedy_pack = _njit(cache=True)(_greedy_pack)
+
+
+def chunk_text(text: str, max_words: int = 180) -> List[str]:
+    sents = _simple_sentence_split(text)
+    chunks = []
+    if sents:
+        word_counts = np.fromiter(
+            (len(s.split()) for s in sents), dtype=np.int64, count=len(sents)
+        )
+        bounds = _greedy_pack(word_counts, max_words)
+        bounds = bounds.tolist()
+        chunks = [" ".join(sents[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
     if not chunks and text:
         words = text.split()
         for i in range(0, len(words), max_words):
@@ -67,174 +169,1054 @@ def chunk_text(text: str, max_words: int = 180) -> List[str]:
     return chunks
 
 
+def _pick_device() -> str:
+    if EMBED_DEVICE != "auto":
+        return EMBED_DEVICE
+    import torch  # already loaded by sentence-transformers
+
+    if torch.cuda.is_available():
+        return "cuda"
+    mps = getattr(torch.backends, "mps", None)
+    if mps is not None and mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def quantize_int8(embs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # symmetric per-vector quantization: v ~= q * scale, q in [-127, 127]
+    embs = np.atleast_2d(np.asarray(embs, dtype=np.float32))
+    scale = np.max(np.abs(embs), axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    q = np.round(embs / scale[:, None]).astype(np.int8)
+    return q, scale.astype(np.float32)
+
+
+def _new_hnsw(dim: int):
+    ann = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    ann.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    return ann
+
+
+def _is_normalized(embs: np.ndarray, sample: int = 100) -> bool:
+    # cheap spot check on the first rows; retrieve relies on unit-length rows
+    norms = np.linalg.norm(np.asarray(embs[:sample], dtype=np.float32), axis=1)
+    return bool(np.allclose(norms, 1.0, atol=1e-3))
+
+
+def _save_npy_atomic(path: str, arr: np.ndarray):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+class _NpyAppender:
+    # .npy file that grows by appending rows; the header is rewritten on close
+    def __init__(self, path: str, dtype, row_shape: Tuple[int, ...]):
+        self.rows = 0
+        self._dtype = np.dtype(dtype)
+        self._row_shape = tuple(row_shape)
+        self._f = open(path, "wb")
+        self._write_header()
+        self._data_offset = self._f.tell()
+
+    def _write_header(self):
+        np.lib.format.write_array_header_1_0(
+            self._f,
+            {
+                "descr": np.lib.format.dtype_to_descr(self._dtype),
+                "fortran_order": False,
+                "shape": (self.rows,) + self._row_shape,
+            },
+        )
+
+    def append(self, arr: np.ndarray):
+        arr = np.ascontiguousarray(arr, dtype=self._dtype)
+        self._f.write(arr.tobytes())
+        self.rows += arr.shape[0]
+
+    def close(self):
+        if self._f.closed:
+            return
+        # numpy pads the header so the row count can be rewritten in place
+        self._f.seek(0)
+        self._write_header()
+        if self._f.tell() != self._data_offset:
+            raise ValueError(f"npy header size changed for {self._f.name}")
+        self._f.close()
+
+
+class _IndexWriter:
+    # streams the local index to *.tmp files, swapped in atomically on commit
+    def __init__(self):
+        self.count = 0
+        self._arrays: Dict[str, _NpyAppender] = {}
+        self._ann = None
+        # meta columns; doc ids are dictionary-encoded since they repeat
+        self._doc_names: Dict[str, int] = {}
+        self._doc_codes: List[int] = []
+        self._chunk_idxs: List[int] = []
+        self._id_tags: List[bytes] = []
+        self._text_f = open(TEXT_PATH + ".tmp", "wb")
+        self._text_bytes = 0
+        self._append_array(TEXT_OFF_PATH, np.zeros(1, dtype=np.int64))
+
+    def _append_array(self, path: str, arr: np.ndarray):
+        if path not in self._arrays:
+            self._arrays[path] = _NpyAppender(path + ".tmp", arr.dtype, arr.shape[1:])
+        self._arrays[path].append(arr)
+
+    def append(self, embs: np.ndarray, metas: List[Dict[str, Any]], chunks: List[str]):
+        embs = np.ascontiguousarray(embs, dtype=np.float32)
+        q8, scale = quantize_int8(embs)
+        self._append_array(EMB_PATH, embs)
+        self._append_array(EMB_Q8_PATH, q8)
+        self._append_array(EMB_SCALE_PATH, scale)
+        if faiss is not None:
+            if self._ann is None:
+                self._ann = _new_hnsw(embs.shape[1])
+            self._ann.add(embs)
+        for m in metas:
+            code = self._doc_names.setdefault(m["doc_id"], len(self._doc_names))
+            self._doc_codes.append(code)
+            self._chunk_idxs.append(m["chunk_idx"])
+            self._id_tags.append(m["id"].rsplit(":", 1)[1].encode("ascii"))
+        blobs = [ch.encode("utf-8") for ch in chunks]
+        ends = self._text_bytes + np.cumsum([len(b) for b in blobs], dtype=np.int64)
+        self._text_f.write(b"".join(blobs))
+        self._append_array(TEXT_OFF_PATH, ends)
+        self._text_bytes = int(ends[-1]) if len(blobs) else self._text_bytes
+        self.count += len(chunks)
+
+    def _close(self):
+        for a in self._arrays.values():
+            a.close()
+        self._text_f.close()
+
+    def _write_metas(self):
+        with open(META_PATH + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                doc_names=np.array(list(self._doc_names), dtype=str),
+                doc_codes=np.array(self._doc_codes, dtype=np.int32),
+                chunk_idxs=np.array(self._chunk_idxs, dtype=np.int32),
+                id_tags=np.array(self._id_tags, dtype="S8"),
+            )
+
+    def commit(self):
+        self._close()
+        self._write_metas()
+        if self._ann is not None:
+            faiss.write_index(self._ann, HNSW_PATH + ".tmp")
+            os.replace(HNSW_PATH + ".tmp", HNSW_PATH)
+        elif os.path.exists(HNSW_PATH):
+            os.remove(HNSW_PATH)  # stale graph from an earlier faiss-enabled ingest
+        # EMB_PATH goes last: its mtime is what retrievers watch
+        for path in (
+            META_PATH,
+            TEXT_PATH,
+            TEXT_OFF_PATH,
+            EMB_Q8_PATH,
+            EMB_SCALE_PATH,
+            EMB_PATH,
+        ):
+            os.replace(path + ".tmp", path)
+
+    def abort(self):
+        self._close()
+        for path in (META_PATH, TEXT_PATH, HNSW_PATH, *self._arrays):
+            if os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")
+
+
+class _ChunkStore:
+    # read-only view over the chunk blob; chunks[i] decodes only that slice
+    def __init__(self, blob_path: str, off_path: str):
+        self._blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+        self._offsets = np.load(off_path, mmap_mode="r")
+
+    def __len__(self) -> int:
+        return self._offsets.shape[0] - 1
+
+    def __getitem__(self, i: int) -> str:
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return self._blob[start:end].tobytes().decode("utf-8")
+
+
+def _bump_index_generation():
+    os.makedirs(DB_DIR, exist_ok=True)
+    tmp = f"{INDEX_GEN_PATH}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(tmp, INDEX_GEN_PATH)  # new inode + mtime: a new stamp
+
+
+def _stat_sig(path: str) -> str:
+    try:
+        st = os.stat(path)
+        return f"{st.st_mtime_ns}.{st.st_ino}"
+    except OSError:
+        return "-"
+
+
+class _QueryCache:
+    # SIM-LRU of query -> (embedding, hits, generated answers), persisted to
+    # QCACHE_PATH and tied to the index it was computed against. Each cached
+    # result owns one row of a preallocated (capacity, dim) matrix, so the
+    # semantic lookup is a single GEMV; exact-match keys (including
+    # paraphrases aliased onto a row) map to that row's entry, and the row
+    # with the oldest use tick is evicted when the cache is full.
+    def __init__(self, path: str, capacity: int, threshold: float):
+        self.path = path
+        self.capacity = capacity
+        self.threshold = threshold
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._mat: np.ndarray | None = None  # (capacity, dim), allocated on first put
+        self._row_k = np.full(max(capacity, 0), -1, dtype=np.int64)  # -1: free
+        self._row_tick = np.zeros(max(capacity, 0), dtype=np.int64)
+        self._row_entry: List[Dict[str, Any] | None] = [None] * max(capacity, 0)
+        self._tick = 0
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self._loaded = False
+        self._stamp = None  # index stamp the cached entries belong to
+        # the file is written by a background thread, outside _lock
+        self._save_due = threading.Event()
+        self._saver: threading.Thread | None = None
+        self._write_lock = threading.Lock()
+
+    @staticmethod
+    def _key(query: str, k: int) -> str:
+        query = _norm_query(query)
+        return hashlib.sha256(f"{k}\x00{query}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _index_stamp() -> str:
+        # the local index file covers writers that predate INDEX_GEN_PATH;
+        # the generation file is what changes in Qdrant mode
+        return f"{_stat_sig(EMB_PATH)}:{_stat_sig(INDEX_GEN_PATH)}"
+
+    def stamp(self) -> str:
+        # taken before a retrieval, handed back to put()
+        return self._index_stamp()
+
+    def _sync(self):
+        # two stats per lookup: another process may have re-ingested or
+        # cleared since, and then every cached hit/answer is stale
+        self._load()
+        stamp = self._index_stamp()
+        if stamp != self._stamp:
+            self._reset()
+            self._dirty = 0
+            self._stamp = stamp
+
+    def get(self, query: str, k: int):
+        if self.capacity <= 0:
+            return None
+        with self._lock:
+            self._sync()
+            entry = self._entries.get(self._key(query, k))
+            if entry is not None:
+                self._use(entry["row"])
+            return entry
+
+    def get_similar(self, query: str, k: int, q_emb: np.ndarray):
+        if self.capacity <= 0:
+            return None
+        with self._lock:
+            self._sync()
+            if self._mat is None or self._mat.shape[1] != q_emb.shape[0]:
+                return None
+            sims = self._mat @ q_emb
+            sims[self._row_k != k] = -np.inf  # only results for the same k
+            j = int(np.argmax(sims))
+            if sims[j] < self.threshold:
+                return None
+            # alias this phrasing so a repeat is an exact hit next time
+            entry = self._row_entry[j]
+            key = self._key(query, k)
+            self._entries[key] = entry
+            entry["keys"].append(key)
+            self._use(j)
+            self._touch()
+            return entry
+
+    def put(
+        self,
+        query: str,
+        k: int,
+        q_emb: np.ndarray,
+        hits: List[Dict[str, Any]],
+        stamp: str | None = None,
+    ):
+        # stamp: self.stamp() from before the search; if the index changed
+        # meanwhile, the hits are returned but not cached
+        entry = {"k": k, "hits": hits, "answers": {}, "keys": []}
+        if self.capacity > 0:
+            with self._lock:
+                self._sync()
+                if stamp is None or stamp == self._stamp:
+                    self._insert([self._key(query, k)], entry, q_emb)
+                    self._touch()
+        return entry
+
+    def set_answer(self, entry: Dict[str, Any], variant: str, answer: str):
+        with self._lock:
+            entry["answers"][variant] = answer
+            self._touch()
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+            self._dirty = 0
+            self._loaded = True  # don't resurrect the stale file
+            self._stamp = self._index_stamp()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def save(self):
+        # snapshot under the lock, serialize and write outside it
+        with self._lock:
+            snap = self._snapshot() if self._dirty else None
+        if snap is not None:
+            self._write(snap)
+
+    def _reset(self):
+        self._entries.clear()
+        self._mat = None
+        self._row_k[:] = -1
+        self._row_tick[:] = 0
+        self._row_entry = [None] * self.capacity
+
+    def _use(self, row: int):
+        self._tick += 1
+        self._row_tick[row] = self._tick
+
+    def _insert(self, keys: List[str], entry: Dict[str, Any], emb: np.ndarray):
+        if self._mat is None or self._mat.shape[1] != emb.shape[0]:
+            self._reset()
+            self._mat = np.zeros((self.capacity, emb.shape[0]), dtype=np.float32)
+        for key in keys:
+            old = self._entries.get(key)
+            if old is not None:
+                old["keys"].remove(key)
+        # a free row if there is one, else the least recently used
+        free = np.flatnonzero(self._row_k < 0)
+        row = int(free[0]) if len(free) else int(np.argmin(self._row_tick))
+        victim = self._row_entry[row]
+        if victim is not None:
+            for key in victim["keys"]:
+                self._entries.pop(key, None)
+        entry["row"] = row
+        entry["keys"] = list(keys)
+        self._mat[row] = emb
+        self._row_k[row] = entry["k"]
+        self._row_entry[row] = entry
+        for key in keys:
+            self._entries[key] = entry
+        self._use(row)
+
+    def _touch(self):
+        self._dirty += 1
+        if self._dirty >= QCACHE_SAVE_EVERY:
+            self._save_due.set()
+            # (re)started lazily: threads don't survive a gunicorn fork
+            if self._saver is None or not self._saver.is_alive():
+                self._saver = threading.Thread(
+                    target=self._save_loop, name="qcache-save", daemon=True
+                )
+                self._saver.start()
+
+    def _save_loop(self):
+        while True:
+            self._save_due.wait()
+            self._save_due.clear()
+            try:
+                self.save()
+            except Exception as e:
+                print(f"[WARN] Query cache save failed: {e}", file=sys.stderr)
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        self._stamp = self._index_stamp()
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as z:
+                if "off" not in z.files or str(z["stamp"]) != self._stamp:
+                    return  # older format, or computed against a different index
+                # row i's JSON is blob[off[i]:off[i+1]]
+                blob, off = z["blob"].tobytes(), z["off"]
+                rows = zip(z["ks"], z["ticks"], z["embs"])
+                for i, (k, tick, emb) in enumerate(rows):
+                    data = json.loads(blob[off[i] : off[i + 1]])
+                    entry = {
+                        "k": int(k),
+                        "hits": data["hits"],
+                        "answers": data["answers"],
+                    }
+                    self._insert(data["keys"], entry, emb)
+                    self._row_tick[entry["row"]] = int(tick)
+                self._tick = int(self._row_tick.max(initial=0))
+        except Exception as e:
+            print(f"[WARN] Ignoring unreadable query cache: {e}", file=sys.stderr)
+            self._reset()
+
+    def _snapshot(self):
+        # copies of the live rows, cheap enough to take under _lock; the
+        # entry dicts are copied one level since requests keep mutating them
+        self._dirty = 0
+        rows = np.flatnonzero(self._row_k >= 0)
+        if not len(rows):
+            return None
+        docs = [
+            {"keys": list(e["keys"]), "hits": e["hits"], "answers": dict(e["answers"])}
+            for e in (self._row_entry[r] for r in rows)
+        ]
+        return (
+            self._stamp,
+            self._row_k[rows],
+            self._row_tick[rows],
+            self._mat[rows],
+            docs,
+        )
+
+    def _write(self, snap):
+        # variable-length rows: one UTF-8 blob plus an int64 offset table, as
+        # for chunks.bin, instead of a fixed-width array padded to the longest
+        stamp, ks, ticks, embs, docs = snap
+        parts = [
+            json.dumps(d, ensure_ascii=False, separators=_COMPACT).encode("utf-8")
+            for d in docs
+        ]
+        off = np.zeros(len(parts) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in parts], out=off[1:])
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # per-process tmp name: every API worker saves to the same path
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with self._write_lock:
+            with open(tmp, "wb") as f:
+                np.savez(
+                    f,
+                    stamp=np.array(stamp),
+                    ks=ks,
+                    ticks=ticks,
+                    embs=embs,
+                    blob=np.frombuffer(b"".join(parts), dtype=np.uint8),
+                    off=off,
+                )
+            os.replace(tmp, self.path)
+
+
+_Q_CACHE = _QueryCache(QCACHE_PATH, QCACHE_SIZE, QCACHE_SIM_THRESHOLD)
+atexit.register(_Q_CACHE.save)
+
+
+# loaded llama.cpp models keyed by (resolved path, n_ctx) -> (Llama, lock);
+# a llama.cpp context is not safe for concurrent completions
+_LLM_CACHE: Dict[Tuple[str, int], Tuple[Any, threading.Lock]] = {}
+_LLM_CACHE_LOCK = threading.Lock()
+# query embeddings only depend on the text, so unlike _Q_CACHE this LRU
+# survives re-ingest and is shared across different k
+_QEMB_CACHE: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_QEMB_CACHE_LOCK = threading.Lock()
+_QEMB_DISK = None  # diskcache.Cache, opened on first use (after any fork)
+
+
+def _norm_query(query: str) -> str:
+    # cache key for a query; the MiniLM tokenizer is uncased and splits on
+    # whitespace, so this doesn't change the embedding
+    return " ".join(query.split()).lower()
+
+
+def _qemb_disk():
+    global _QEMB_DISK
+    if _QEMB_DISK is None and diskcache is not None and QEMB_DISK_PATH:
+        with _QEMB_CACHE_LOCK:
+            if _QEMB_DISK is None:
+                try:
+                    _QEMB_DISK = diskcache.Cache(
+                        QEMB_DISK_PATH, size_limit=QEMB_DISK_LIMIT
+                    )
+                except Exception as e:
+                    print(
+                        f"[WARN] Query embedding disk cache off: {e}", file=sys.stderr
+                    )
+                    _QEMB_DISK = False
+    # (not `or`: an empty Cache is falsy since it defines __len__)
+    return None if _QEMB_DISK is False else _QEMB_DISK
+
+
+def _resolve_model_path(model_name: str) -> str | None:
+    # Helper function to resolve model path, using global DEFAULT_GPT4ALL_MODEL
+    if os.path.isfile(model_name):
+        return model_name
+
+    # Simple search paths
+    paths = [os.getcwd()]
+    for path in paths:
+        candidate = os.path.join(path, model_name)
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+class QueryBatcher:
+    # micro-batching: retrieve calls from concurrent request threads are
+    # queued, and a worker drains up to QUERY_BATCH_MAX of them (waiting at
+    # most QUERY_BATCH_WAIT_MS for stragglers) into one encode + one GEMM
+    def __init__(self, service: "RAGService"):
+        self._service = service
+        self._queue: "queue.Queue[Tuple[str, int, Future]]" = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, query: str, k: int) -> Future:
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                # (re)started lazily; a dead worker is replaced, so one
+                # fatal error doesn't wedge every later request
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, name="rag-query-batcher", daemon=True
+                    )
+                    self._thread.start()
+        fut: Future = Future()
+        self._queue.put((query, k, fut))
+        return fut
+
+    def _drain(self):
+        items = [self._queue.get()]
+        deadline = time.monotonic() + QUERY_BATCH_WAIT_MS / 1000.0
+        while len(items) < QUERY_BATCH_MAX:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._drain()
+            try:
+                results = self._service._retrieve_entries(
+                    [q for q, _, _ in items], [k for _, k, _ in items]
+                )
+                for (_, _, fut), res in zip(items, results):
+                    fut.set_result(res)
+            except BaseException as e:
+                for _, _, fut in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+                if not isinstance(e, Exception):
+                    raise  # thread exits; the next submit() starts a new one
+
+
 # RAGService Class: Encapsulates all Core Logic
 class RAGService:
-    def __init__(self):
-        # Service initialization logic (can load models/DBs here if needed)
-        pass
+    # process-wide caches shared by all instances (one per Django worker)
+    _model = None  # SentenceTransformer, loaded lazily on first use
+    # ((mtime, version), (embs, scale, metas, chunks, ann)); metas is the
+    # (doc_names, doc_codes, chunk_idxs, id_tags) column tuple from META_PATH
+    _index_cache = None
+    _index_version = 0  # bumped by _save_index to force a reload
+    _lock = threading.Lock()
+    # local index builds write fixed db/*.tmp paths, so they must not overlap
+    # (see _index_write_lock for the cross-process half)
+    _ingest_lock = threading.Lock()
+    # default GGUF path, resolved once at import; None until the file exists
+    _RESOLVED_MODEL = _resolve_model_path(DEFAULT_GPT4ALL_MODEL)
+
+    def __init__(self, batch_queries: bool = False):
+        # batch_queries: coalesce concurrent retrieve() calls (API server use)
+        self._batcher = QueryBatcher(self) if batch_queries else None
 
     def _ensure_db_dir(self):
         os.makedirs(DB_DIR, exist_ok=True)
 
+    @contextmanager
+    def _index_write_lock(self):
+        # one index writer at a time: _ingest_lock between this process's
+        # threads, INDEX_LOCK_PATH between processes sharing db/
+        self._ensure_db_dir()
+        with RAGService._ingest_lock, FileLock(INDEX_LOCK_PATH):
+            yield
+
     def _load_embedding_model(self):
-        return SentenceTransformer(EMBED_MODEL_NAME)
+        if RAGService._model is None:
+            with RAGService._lock:
+                if RAGService._model is None:
+                    device = _pick_device()
+                    model = SentenceTransformer(EMBED_MODEL_NAME, device=device)
+                    if device == "cuda":
+                        model.half()  # tensor-core matmuls, half the memory
+                    RAGService._model = model
+        return RAGService._model
 
-    def _save_index(
-        self, embs: np.ndarray, metas: List[Dict[str, Any]], chunks: List[str]
-    ):
+    def _save_index(self, writer: _IndexWriter):
         # core method to persist RAG indexing in local docs
-        self._ensure_db_dir()
-        np.save(EMB_PATH, embs)
-        with open(META_PATH, "w", encoding="utf-8") as f:
-            json.dump(metas, f, ensure_ascii=False, indent=2)
-        with open(TEXT_PATH, "w", encoding="utf-8") as f:
-            json.dump(chunks, f, ensure_ascii=False)
+        # invalidate the cached index first: this also drops our mmap of the
+        # old files, which Windows requires before they can be replaced
+        with RAGService._lock:
+            RAGService._index_version += 1
+            RAGService._index_cache = None
+        writer.commit()
+
+    def clear_query_cache(self):
+        # cached hits/answers refer to the old index contents; the bump
+        # tells the other processes' caches too
+        _bump_index_generation()
+        _Q_CACHE.clear()
 
     def _load_index(self):
         if not (
             os.path.exists(EMB_PATH)
             and os.path.exists(META_PATH)
             and os.path.exists(TEXT_PATH)
+            and os.path.exists(TEXT_OFF_PATH)
         ):
-            return None, None, None
+            return None, None, None, None, None
 
         try:
-            embs = np.load(EMB_PATH)
-            with open(META_PATH, "r", encoding="utf-8") as f:
-                metas = json.load(f)
-            with open(TEXT_PATH, "r", encoding="utf-8") as f:
-                chunks = json.load(f)
-            return embs, metas, chunks
+            # scan the int8 copy when present; float32 stays the source of truth
+            scale = None
+            if (
+                QUANTIZE_INT8
+                and os.path.exists(EMB_Q8_PATH)
+                and os.path.exists(EMB_SCALE_PATH)
+            ):
+                embs = np.load(EMB_Q8_PATH, mmap_mode="r")
+                scale = np.load(EMB_SCALE_PATH, mmap_mode="r")
+            else:
+                # mmap: pages fault in lazily and the page cache is shared
+                # by every worker process instead of one copy per worker
+                embs = np.load(EMB_PATH, mmap_mode="r")
+            with np.load(META_PATH) as z:
+                metas = (z["doc_names"], z["doc_codes"], z["chunk_idxs"], z["id_tags"])
+            chunks = _ChunkStore(TEXT_PATH, TEXT_OFF_PATH)
+            ann = None
+            if faiss is not None and os.path.exists(HNSW_PATH):
+                ann = faiss.read_index(HNSW_PATH)
+                if ann.ntotal != len(metas[1]):
+                    ann = None  # out of sync with the flat index: brute-force
+                else:
+                    ann.hnsw.efSearch = HNSW_EF_SEARCH
+            return embs, scale, metas, chunks, ann
         except Exception as e:
             print(f"[ERROR] Failed to load RAG index files: {e}", file=sys.stderr)
-            return None, None, None
+            return None, None, None, None, None
+
+    @staticmethod
+    def _scores(embs: np.ndarray, q_embs: np.ndarray, scale=None) -> np.ndarray:
+        # (N, B) cosine similarities for B queries; embeddings are
+        # L2-normalized, so this is a single GEMV/GEMM
+        if scale is None:
+            return embs @ q_embs.T
+        # int8 rows: dequantize block by block so the float32 temporary
+        # stays cache-sized, then apply the per-vector scale once
+        sims = np.empty((embs.shape[0], q_embs.shape[0]), dtype=np.float32)
+        for s in range(0, embs.shape[0], SCAN_BLOCK_ROWS):
+            blk = embs[s : s + SCAN_BLOCK_ROWS]
+            sims[s : s + blk.shape[0]] = blk.astype(np.float32) @ q_embs.T
+        sims *= np.asarray(scale)[:, None]
+        return sims
+
+    @staticmethod
+    def _top_k(embs: np.ndarray, q_embs: np.ndarray, k: int, scale=None):
+        # per-query top-k via argpartition along the corpus axis;
+        # returns (indices, sims), both shaped (B, k) and sorted best-first
+        sims = RAGService._scores(embs, q_embs, scale)
+        top = np.argpartition(-sims, k - 1, axis=0)[:k]
+        part = np.take_along_axis(sims, top, axis=0)
+        order = np.argsort(-part, axis=0)
+        top = np.take_along_axis(top, order, axis=0)
+        part = np.take_along_axis(part, order, axis=0)
+        return top.T, part.T
+
+    def _get_index(self):
+        # reuse the loaded index until embeddings.npy changes
+        try:
+            mtime = os.path.getmtime(EMB_PATH)
+        except OSError:
+            return None, None, None, None, None
+        key = (mtime, RAGService._index_version)
+        cache = RAGService._index_cache
+        if cache is not None and cache[0] == key:
+            return cache[1]
+
+        if not _is_normalized(np.load(EMB_PATH, mmap_mode="r")):
+            with self._index_write_lock():
+                # another worker (or an ingest) may have rewritten it meanwhile
+                if not _is_normalized(np.load(EMB_PATH, mmap_mode="r")):
+                    self._renormalize_index()
+            key = (os.path.getmtime(EMB_PATH), RAGService._index_version)
+
+        embs, scale, metas, chunks, ann = self._load_index()
+        if embs is None:
+            return None, None, None, None, None
+
+        # C-contiguous 2D so the matmul dispatches to BLAS SGEMV
+        if scale is None:
+            embs = np.ascontiguousarray(np.atleast_2d(embs), dtype=np.float32)
 
-    def _fit_nn(self, embs: np.ndarray) -> Any:
-        # use NN of scikit-learn to train vector indexing model, import as need
-        from sklearn.neighbors import NearestNeighbors
+        index = (embs, scale, metas, chunks, ann)
+        with RAGService._lock:
+            RAGService._index_cache = (key, index)
+        return index
 
-        nn = NearestNeighbors(
-            n_neighbors=min(embs.shape[0], 50), metric="cosine"
-        )  # use cosine similarity to search
-        nn.fit(embs)
-        return nn
+    def _renormalize_index(self):
+        # embeddings written by another tool may not be unit-length; fix them
+        # once on disk so every retrieve can stay a plain inner product
+        print("[WARN] Index embeddings are not L2-normalized; fixing on disk.")
+        embs = np.load(EMB_PATH).astype(np.float32, copy=False)
+        norms = np.linalg.norm(embs, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        embs /= norms
+        q8, scale = quantize_int8(embs)
+        _save_npy_atomic(EMB_Q8_PATH, q8)
+        _save_npy_atomic(EMB_SCALE_PATH, scale)
+        if faiss is not None:
+            ann = _new_hnsw(embs.shape[1])
+            ann.add(embs)
+            tmp = f"{HNSW_PATH}.{os.getpid()}.tmp"
+            faiss.write_index(ann, tmp)
+            os.replace(tmp, HNSW_PATH)
+        elif os.path.exists(HNSW_PATH):
+            os.remove(HNSW_PATH)  # graph was built on the unnormalized rows
+        _save_npy_atomic(EMB_PATH, embs)
 
-    def ingest_files(self, patterns: List[str]) -> int:
+    def ingest_files(
+        self, patterns: List[str], blobs: List[Tuple[str, bytes]] = ()
+    ) -> int:
+        # blobs: in-memory PDFs as (name, bytes), ingested in the same pass
+        # (and the same index build) as the files matched by patterns
+        return sum(self.ingest_batch(patterns, blobs).values())
+
+    def ingest_batch(
+        self, patterns: List[str], blobs: List[Tuple[str, bytes]] = ()
+    ) -> Dict[str, int]:
+        # like ingest_files, but returns chunks ingested per document; files
+        # that yielded no text are missing from the result
         paths = []
         for pat in patterns:
             paths.extend(glob.glob(pat))
         paths = [p for p in sorted(set(paths)) if p.lower().endswith(".pdf")]
-        if not paths:
+        if not paths and not blobs:
             print("[INFO] No PDFs found.")
-            return 0
+            return {}
+
+        return self._ingest_docs(load_pdfs(paths, blobs))
+
+    def ingest_bytes(self, name: str, data: bytes) -> int:
+        # ingest one PDF held in memory (e.g. a small upload), no disk round-trip
+        return self.ingest_files([], blobs=[(name, data)])
+
+    def embed_batch(
+        self, texts: List[str], batch_size: int = EMBED_BATCH_SIZE, **kw
+    ) -> np.ndarray:
+        # one encode() call for the whole list; the model splits it into
+        # forward passes of batch_size
+        return (
+            self._load_embedding_model()
+            .encode(
+                texts,
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,  # to ensure the accuracy of cosine similarity search
+                **kw,
+            )
+            .astype(np.float32, copy=False)
+        )
 
-        docs = load_pdfs(paths)
-        model = self._load_embedding_model()
+    def _ingest_docs(self, docs: List[Tuple[str, str]]) -> Dict[str, int]:
+        if _use_qdrant():
+            return self._write_docs(docs)  # Qdrant upserts can run concurrently
+        with self._index_write_lock():
+            return self._write_docs(docs)
 
-        all_chunks, metas = [], []
-        for doc_id, text in docs:
-            chunks = chunk_text(text, max_words=180)
-            for i, ch in enumerate(chunks):
-                all_chunks.append(ch)
-                metas.append(
+    def _write_docs(self, docs: List[Tuple[str, str]]) -> Dict[str, int]:
+        # load up front so a missing model fails before any tmp file exists
+        self._load_embedding_model()
+
+        writer = None
+        if not _use_qdrant():
+            self._ensure_db_dir()
+            writer = _IndexWriter()
+
+        def _chunks():
+            for doc_id, text in docs:
+                for i, ch in enumerate(chunk_text(text, max_words=180)):
+                    yield doc_id, i, ch
+
+        n_chunks = 0
+        per_doc: Dict[str, int] = {}
+        stream = _chunks()
+        try:
+            # encode and flush in fixed-size batches that span documents, so
+            # small PDFs still fill the encoder's batches and peak memory is
+            # O(batch) instead of O(corpus)
+            while items := list(islice(stream, INGEST_BATCH)):
+                batch = [ch for _, _, ch in items]
+                metas = [
                     {
                         "doc_id": doc_id,
                         "chunk_idx": i,
                         "id": f"{doc_id}:{i}:{uuid.uuid4().hex[:8]}",
                     }
-                )
+                    for doc_id, i, _ in items
+                ]
+                embs = self.embed_batch(batch, show_progress_bar=True)
+
+                # switcher for Qdrant
+                if _use_qdrant():
+                    payloads = []
+                    for m, ch in zip(metas, batch):
+                        payloads.append(
+                            {
+                                "qid": m.get("id"),
+                                "doc_id": m["doc_id"],
+                                "chunk_idx": m["chunk_idx"],
+                                "text": ch,
+                            }
+                        )
+
+                    _qdrant.upsert(vectors=embs.tolist(), payloads=payloads)
+                else:
+                    writer.append(embs, metas, batch)
+                n_chunks += len(batch)
+                for doc_id, _, _ in items:
+                    per_doc[doc_id] = per_doc.get(doc_id, 0) + 1
+        except Exception:
+            if writer is not None:
+                writer.abort()
+            raise
 
-        if not all_chunks:
+        if not n_chunks:
+            if writer is not None:
+                writer.abort()
             print("[WARN] No text chunks extracted.")
-            return 0
+            return {}
 
-        embs = model.encode(
-            all_chunks,
-            show_progress_bar=True,
-            convert_to_numpy=True,
-            normalize_embeddings=True,  # to ensure the accuracy of cosine similarity search
-        )
+        if writer is not None:
+            self._save_index(writer)
+        self.clear_query_cache()
 
-        # switcher for Qdrant
-        if USE_QDRANT:
-            payloads = []
-            for m, ch in zip(metas, all_chunks):
-                payloads.append(
-                    {
-                        "qid": m.get("id"),
-                        "doc_id": m["doc_id"],
-                        "chunk_idx": m["chunk_idx"],
-                        "text": ch,
-                    }
-                )
+        print(f"[OK] Ingested {len(docs)} docs, {n_chunks} chunks.")
+        return per_doc
 
-            _qdrant.upsert(vectors=embs.tolist(), payloads=payloads)
-        else:
-            self._save_index(embs, metas, all_chunks)
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        # hot queries skip the transformer forward pass: memory LRU first,
+        # then the disk cache; only the remaining misses go to encode(), in
+        # one batch
+        queries = [_norm_query(q) for q in queries]
+        with _QEMB_CACHE_LOCK:
+            cached = [_QEMB_CACHE.get(q) for q in queries]
+            for q, v in zip(queries, cached):
+                if v is not None:
+                    _QEMB_CACHE.move_to_end(q)
+        misses = list(dict.fromkeys(q for q, v in zip(queries, cached) if v is None))
+        if misses:
+            disk = _qemb_disk()
+            fresh, todo = {}, misses
+            if disk is not None:
+                todo = []
+                for q in misses:
+                    raw = disk.get(self._disk_key(q))
+                    if raw is None:
+                        todo.append(q)
+                    else:
+                        fresh[q] = np.frombuffer(raw, dtype=np.float32)
+            if todo:
+                new = self.embed_batch(todo, batch_size=QUERY_BATCH_MAX)
+                for q, v in zip(todo, new):
+                    fresh[q] = v
+                    if disk is not None:
+                        disk.set(self._disk_key(q), v.tobytes())
+            cached = [fresh[q] if v is None else v for q, v in zip(queries, cached)]
+            with _QEMB_CACHE_LOCK:
+                _QEMB_CACHE.update(fresh)
+                while len(_QEMB_CACHE) > QEMB_CACHE_SIZE:
+                    _QEMB_CACHE.popitem(last=False)
+        return np.stack(cached)
 
-        print(f"[OK] Ingested {len(docs)} docs, {len(all_chunks)} chunks.")
-        return len(all_chunks)
+    @staticmethod
+    def _disk_key(query: str) -> str:
+        # the model name is part of the key so a model swap can't hit stale rows
+        return hashlib.sha256(
+            f"{EMBED_MODEL_NAME}\x00{query}".encode("utf-8")
+        ).hexdigest()
 
-    def retrieve(self, query: str, k: int = 4) -> List[Dict[str, Any]]:
-        # switcher for Qdrant
-        if USE_QDRANT:
-            q_emb = (
-                self._load_embedding_model()
-                .encode([query], convert_to_numpy=True, normalize_embeddings=True)[0]
-                .tolist()
-            )
-            hits = _qdrant.search(q_emb, k=k)
-            out = []
-            for h in hits:
-                p = h.get("payload", {})
-                out.append(
-                    {
-                        "id": p.get("qid") or p.get("id") or h.get("id"),
-                        "text": p.get("text", ""),
-                        "meta": {
-                            "doc_id": p.get("doc_id"),
-                            "chunk_idx": p.get("chunk_idx"),
-                        },
-                        "distance": 1.0
-                        - float(
-                            h.get("score", 0.0)
-                        ),  # default similarity measurement: score, to be consistent with distance format
-                    }
-                )
-            return out
+    def _encode_query(self, query: str) -> np.ndarray:
+        return self._encode_queries([query])[0]
 
-        embs, metas, chunks = self._load_index()
-        if embs is None:
-            print("[INFO] No index found. Please run ingest first.")
-            return []
+    @staticmethod
+    def _search_qdrant(q_emb: np.ndarray, k: int) -> List[Dict[str, Any]]:
+        return RAGService._qdrant_hits(_qdrant.search(q_emb, k=k))
 
-        # Ensure embs is 2D and non-empty for NearestNeighbors
-        if embs.ndim == 1:
-            embs = embs.reshape(-1, 1)
+    @staticmethod
+    def _search_qdrant_batch(q_embs: np.ndarray, ks: List[int]):
+        # one batch request instead of len(ks) sequential round trips
+        search_batch = getattr(_qdrant, "search_batch", None)
+        if search_batch is None:
+            return [RAGService._search_qdrant(v, k) for v, k in zip(q_embs, ks)]
+        return [RAGService._qdrant_hits(h) for h in search_batch(q_embs, ks)]
 
-        nn = self._fit_nn(embs)
-        q_emb = self._load_embedding_model().encode(
-            [query], convert_to_numpy=True, normalize_embeddings=True
-        )
+    @staticmethod
+    def _qdrant_hits(hits) -> List[Dict[str, Any]]:
+        out = []
+        for h in hits:
+            p = h.get("payload", {})
+            out.append(
+                {
+                    "id": p.get("qid") or p.get("id") or h.get("id"),
+                    "text": p.get("text", ""),
+                    "meta": {
+                        "doc_id": p.get("doc_id"),
+                        "chunk_idx": p.get("chunk_idx"),
+                    },
+                    "distance": 1.0
+                    - float(
+                        h.get("score", 0.0)
+                    ),  # default similarity measurement: score, to be consistent with distance format
+                }
+            )
+        return out
 
+    def _search_local(
+        self, index, q_embs: np.ndarray, k: int
+    ) -> List[List[Dict[str, Any]]]:
+        # one hit list per row of q_embs
+        embs, scale, metas, chunks, ann = index
         # Handle case where k is greater than available chunks
         n_neighbors = min(k, embs.shape[0])
-        if n_neighbors == 0:
-            return []
+        if n_neighbors <= 0:
+            return [[] for _ in range(q_embs.shape[0])]
 
-        distances, indices = nn.kneighbors(q_emb, n_neighbors=n_neighbors)
-        hits = []
-        for idx, dist in zip(indices[0], distances[0]):
-            meta = metas[idx]
-            hits.append(
+        if ann is not None:
+            # HNSW search: O(log N) graph walk instead of a full scan
+            sims_all, indices_all = ann.search(q_embs, n_neighbors)
+        else:
+            indices_all, sims_all = self._top_k(embs, q_embs, n_neighbors, scale=scale)
+
+        doc_names, doc_codes, chunk_idxs, id_tags = metas
+        out = []
+        for indices, sims in zip(indices_all, sims_all):
+            keep = indices >= 0  # HNSW pads with -1 when it finds fewer
+            indices, sims = indices[keep], sims[keep]
+            # gather the k rows from the meta columns in one fancy-index each
+            doc_ids = doc_names[doc_codes[indices]].tolist()
+            chunk_is = chunk_idxs[indices].tolist()
+            tags = id_tags[indices].tolist()
+            texts = [chunks[i] for i in indices.tolist()]
+            dists = (1.0 - sims).tolist()  # cosine distance, as before
+            # one comprehension over pre-gathered columns: no per-hit
+            # indexing of numpy arrays inside the loop
+            hits = [
                 {
-                    "id": meta.get("id", f"{meta['doc_id']}:{meta['chunk_idx']}"),
-                    "text": chunks[idx],
-                    "meta": {"doc_id": meta["doc_id"], "chunk_idx": meta["chunk_idx"]},
-                    "distance": float(dist),
+                    "id": f"{d}:{c}:{t.decode('ascii')}",
+                    "text": txt,
+                    "meta": {"doc_id": d, "chunk_idx": c},
+                    "distance": x,
                 }
+                for d, c, t, txt, x in zip(doc_ids, chunk_is, tags, texts, dists)
+            ]
+            out.append(hits)
+        return out
+
+    def _retrieve_entries(self, queries: List[str], ks: List[int]):
+        # batched core of retrieval: [(hits, cache entry)] per query; the
+        # entry is None when nothing was found. Cache misses share one
+        # encode() call and one scoring pass over the index.
+        results: List[Any] = [None] * len(queries)
+        misses = []
+        for i, (query, k) in enumerate(zip(queries, ks)):
+            entry = _Q_CACHE.get(query, k)
+            if entry is not None:
+                results[i] = (entry["hits"], entry)
+            else:
+                misses.append(i)
+        if not misses:
+            return results
+
+        stamp = _Q_CACHE.stamp()  # before the index is read
+        index = None
+        if not _use_qdrant():
+            index = self._get_index()
+            if index[0] is None:
+                print("[INFO] No index found. Please run ingest first.")
+                for i in misses:
+                    results[i] = ([], None)
+                return results
+
+        q_embs = self._encode_queries([queries[i] for i in misses])
+        todo = []
+        for row, i in enumerate(misses):
+            entry = _Q_CACHE.get_similar(queries[i], ks[i], q_embs[row])
+            if entry is not None:
+                results[i] = (entry["hits"], entry)
+            else:
+                todo.append((row, i))
+        if not todo:
+            return results
+
+        # switcher for Qdrant
+        rows = [row for row, _ in todo]
+        if _use_qdrant():
+            found = self._search_qdrant_batch(q_embs[rows], [ks[i] for _, i in todo])
+        else:
+            # search once with the largest k, then cut per query
+            found = self._search_local(index, q_embs[rows], max(ks[i] for _, i in todo))
+            found = [hits[: max(ks[i], 0)] for hits, (_, i) in zip(found, todo)]
+        for (row, i), hits in zip(todo, found):
+            if hits:
+                entry = _Q_CACHE.put(queries[i], ks[i], q_embs[row], hits, stamp)
+                results[i] = (hits, entry)
+            else:
+                results[i] = ([], None)
+        return results
+
+    def _retrieve_entry(self, query: str, k: int):
+        if self._batcher is not None:
+            # bounded: a request fails instead of hanging on a stuck batch
+            return self._batcher.submit(query, k).result(timeout=QUERY_BATCH_TIMEOUT_S)
+        return self._retrieve_entries([query], [k])[0]
+
+    def retrieve(self, query: str, k: int = 4) -> List[Dict[str, Any]]:
+        return self._retrieve_entry(query, k)[0]
+
+    def embed_query(self, query: str) -> np.ndarray:
+        # L2-normalized query vector, through the same caches as retrieve()
+        return self._encode_query(query)
+
+    def embedding_dim(self) -> int:
+        # dim retrieve_by_embedding accepts: the local index's, else the model's
+        if not _use_qdrant():
+            embs = self._get_index()[0]
+            if embs is not None:
+                return int(embs.shape[1])
+        return int(self._load_embedding_model().get_sentence_embedding_dimension())
+
+    def retrieve_by_embedding(self, q_emb, k: int = 4) -> List[Dict[str, Any]]:
+        # retrieve() for a caller that already holds the query vector
+        # (e.g. from embed_query): no encode() call at all
+        q = np.asarray(q_emb, dtype=np.float32).reshape(1, -1)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        if _use_qdrant():
+            return self._search_qdrant(q[0], k)
+        index = self._get_index()
+        if index[0] is None:
+            print("[INFO] No index found. Please run ingest first.")
+            return []
+        if q.shape[1] != index[0].shape[1]:
+            raise ValueError(
+                f"embedding has dim {q.shape[1]}, index has {index[0].shape[1]}"
             )
-        return hits
+        return self._search_local(index, q, k)[0]
 
     # Static LLM-related functions kept outside the class for simplicity
     @staticmethod
@@ -247,48 +1229,103 @@ class RAGService:
         )
 
     @staticmethod
-    def call_llamacpp(prompt: str, model_path: str, max_tokens: int = 1024) -> str:
+    def _load_llm(model_path: str):
+        # returns (llm, lock, resolved_path, error); error is an "[ERROR] ..."
+        # string. The Llama instance is built once per (model, n_ctx) and
+        # reused; callers must hold `lock` while running a completion.
         try:
             from llama_cpp import Llama
         except Exception as e:
-            return f"[ERROR] llama-cpp-python not installed: {e}"
-
-        # Helper function to resolve model path remains, using global DEFAULT_GPT4ALL_MODEL
-        def _resolve_model_path(model_name):
-            if os.path.isfile(model_name):
-                return model_name
-
-            # Simple search paths
-            paths = [os.getcwd()]
-            for path in paths:
-                candidate = os.path.join(path, model_name)
-                if os.path.isfile(candidate):
-                    return candidate
-            return None
+            return None, None, None, f"[ERROR] llama-cpp-python not installed: {e}"
 
-        resolved_model = _resolve_model_path(model_path)
+        if model_path == DEFAULT_GPT4ALL_MODEL:
+            # hot path: no filesystem walk once the default model was found
+            resolved_model = RAGService._RESOLVED_MODEL
+            if resolved_model is None:
+                resolved_model = _resolve_model_path(model_path)
+                RAGService._RESOLVED_MODEL = resolved_model
+        else:
+            resolved_model = _resolve_model_path(model_path)
         if not resolved_model:
-            return f"[ERROR] Model path does not exist for: {model_path}"
+            return (
+                None,
+                None,
+                None,
+                f"[ERROR] Model path does not exist for: {model_path}",
+            )
 
+        key = (resolved_model, LLM_N_CTX)
         try:
-            m = Llama(
-                model_path=resolved_model,
-                n_ctx=4096,
-                n_gpu_layers=0,  # force to use CPU
-                verbose=False,
+            with _LLM_CACHE_LOCK:
+                if key not in _LLM_CACHE:
+                    m = Llama(
+                        model_path=resolved_model,
+                        n_ctx=LLM_N_CTX,
+                        n_gpu_layers=0,  # force to use CPU
+                        verbose=False,
+                    )
+                    _LLM_CACHE[key] = (m, threading.Lock())
+            m, lock = _LLM_CACHE[key]
+            return m, lock, resolved_model, None
+        except Exception as e:
+            return (
+                None,
+                None,
+                resolved_model,
+                f"[ERROR] Failed to run Llama-CPP ({resolved_model}): {e}",
             )
 
-            output = m.create_completion(
-                prompt,
-                max_tokens=max_tokens,
-                temperature=0.2,
-                stop=None,
-            )
+    @staticmethod
+    def call_llamacpp(prompt: str, model_path: str, max_tokens: int = 1024) -> str:
+        m, lock, resolved_model, err = RAGService._load_llm(model_path)
+        if err:
+            return err
+
+        try:
+            with lock:
+                output = m.create_completion(
+                    prompt,
+                    max_tokens=max_tokens,
+                    temperature=0.2,
+                    stop=None,
+                )
             return output["choices"][0]["text"].strip()
         except Exception as e:
             return f"[ERROR] Failed to run Llama-CPP ({resolved_model}): {e}"
         return ""
 
+    @staticmethod
+    def call_llamacpp_stream(prompt: str, model_path: str, max_tokens: int = 1024):
+        # yields text pieces as llama.cpp produces them (time-to-first-token
+        # instead of full-generation latency); errors are yielded as "[ERROR] ..."
+        m, lock, resolved_model, err = RAGService._load_llm(model_path)
+        if err:
+            yield err
+            return
+
+        try:
+            # the context is held for the whole stream; the lock is released
+            # when the generator finishes or is closed by a disconnect
+            with lock:
+                started = False
+                for chunk in m.create_completion(
+                    prompt,
+                    max_tokens=max_tokens,
+                    temperature=0.2,
+                    stop=None,
+                    stream=True,
+                ):
+                    text = chunk["choices"][0]["text"]
+                    if not started:
+                        # match the .strip() of the buffered path
+                        text = text.lstrip()
+                        if not text:
+                            continue
+                        started = True
+                    yield text
+        except Exception as e:
+            yield f"[ERROR] Failed to run Llama-CPP ({resolved_model}): {e}"
+
     def answer(
         self,
         query: str,
@@ -296,13 +1333,24 @@ class RAGService:
         model: str = DEFAULT_GPT4ALL_MODEL,
         max_tokens: int = 1024,
         generate: bool = True,
+        stream: bool = False,
     ) -> Dict[str, Any]:
         print(
             "[DEBUG][answer] args:",
-            {"max_tokens": max_tokens, "generate": generate, "model": model},
+            {
+                "max_tokens": max_tokens,
+                "generate": generate,
+                "model": model,
+                "stream": stream,
+            },
             file=sys.stderr,
         )
-        hits = self.retrieve(query, k=k)
+        hits, entry = self._retrieve_entry(query, k)
+        if stream:
+            # retrieval has run (and raised, if it failed) before the caller
+            # commits to a streaming response
+            return self._answer_stream(query, hits, entry, model, max_tokens, generate)
+
         if not hits:
             return {
                 "answer": "[No results found]",
@@ -325,10 +1373,89 @@ class RAGService:
                 },
             }
 
+        # same (or near-identical) question against the same index: reuse
+        variant = f"{model}|{max_tokens}"
+        cached = entry["answers"].get(variant)
+        if cached is not None:
+            used = {"max_tokens": max_tokens, "answer_len": len(cached), "cached": True}
+            return {"answer": cached, "hits": hits, "used": used}
+
         out = self.call_llamacpp(
             self.build_prompt(query, hits), model_path=model, max_tokens=max_tokens
         )
+        if out and not out.startswith("[ERROR]"):
+            _Q_CACHE.set_answer(entry, variant, out)
 
         used = {"max_tokens": max_tokens, "answer_len": len(out)}
         print("[DEBUG][answer] produced len:", len(out), file=sys.stderr)
         return {"answer": out, "hits": hits, "used": used}
+
+    def _answer_stream(
+        self,
+        query: str,
+        hits: List[Dict[str, Any]],
+        entry,
+        model: str,
+        max_tokens: int,
+        generate: bool,
+    ):
+        # generator counterpart of answer(): yields {"event", "data"} dicts,
+        # "sources" first, then "token" pieces, then "done" with the usage
+        # info; an LLM failure ends the stream with an "error" event instead
+        yield {"event": "sources", "data": hits}
+        if not hits:
+            yield {"event": "token", "data": "[No results found]"}
+            yield {
+                "event": "done",
+                "data": {
+                    "max_tokens": max_tokens,
+                    "answer_len": 0,
+                    "finish_reason": "no_hits",
+                },
+            }
+            return
+        if not generate:
+            ans = "\n---\n".join(h["text"] for h in hits)
+            yield {"event": "token", "data": ans}
+            yield {
+                "event": "done",
+                "data": {
+                    "max_tokens": max_tokens,
+                    "answer_len": len(ans),
+                    "finish_reason": "retrieve_only",
+                },
+            }
+            return
+
+        variant = f"{model}|{max_tokens}"
+        cached = entry["answers"].get(variant)
+        if cached is not None:
+            yield {"event": "token", "data": cached}
+            yield {
+                "event": "done",
+                "data": {
+                    "max_tokens": max_tokens,
+                    "answer_len": len(cached),
+                    "cached": True,
+                },
+            }
+            return
+
+        pieces = []
+        for piece in self.call_llamacpp_stream(
+            self.build_prompt(query, hits), model_path=model, max_tokens=max_tokens
+        ):
+            if piece.startswith("[ERROR]"):
+                yield {"event": "error", "data": piece}
+                return
+            pieces.append(piece)
+            yield {"event": "token", "data": piece}
+        out = "".join(pieces).rstrip()
+        if out and "[ERROR]" not in out:
+            _Q_CACHE.set_answer(entry, variant, out)
+
+        print("[DEBUG][answer] streamed len:", len(out), file=sys.stderr)
+        yield {
+            "event": "done",
+            "data": {"max_tokens": max_tokens, "answer_len": len(out)},
+        }
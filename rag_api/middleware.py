@@ -0,0 +1,15 @@
+# rag_api/middleware.py
+from django.middleware.gzip import GZipMiddleware
+
+
+class BufferedGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware for regular responses only. Streaming responses (the SSE
+    answer stream) pass through untouched: gzip would hold tokens back in its
+    buffer until a whole deflate block is full.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming:
+            return response
+        return super().process_response(request, response)
@@ -0,0 +1,31 @@
+# rag_api/renderers.py
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:  # optional: orjson is several times faster on hit lists with chunk texts
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonRenderer(BaseRenderer):
+    """
+    JSON renderer backed by orjson; numpy scalars/arrays serialize directly.
+    Falls back to DRF's JSONRenderer when orjson isn't installed.
+    """
+
+    media_type = "application/json"
+    format = "json"
+    charset = None  # JSON is always UTF-8
+    _encoder = JSONEncoder()  # DRF's encoder, for types orjson doesn't know
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return JSONRenderer().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b""
+        return orjson.dumps(
+            data,
+            default=self._encoder.default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+        )
@@ -8,6 +8,10 @@ class IngestSerializer(serializers.Serializer):
     """
 
     pdf_file = serializers.FileField(required=True, help_text="PDF file to ingest.")
+    persist = serializers.BooleanField(
+        default=False,
+        help_text="If true, always keep a copy of the upload in ./data/.",
+    )
 
 
 class QuerySerializer(serializers.Serializer):
@@ -27,3 +31,7 @@ class QuerySerializer(serializers.Serializer):
         default=True,
         help_text="If true, use LLM to generate answer; otherwise, return chunks.",
     )
+    stream = serializers.BooleanField(
+        default=False,
+        help_text="If true, stream the answer as text/event-stream (SSE) events.",
+    )
@@ -2,8 +2,11 @@
 from django.urls import path
 from .views import (
     IngestAPIView,
+    IngestBatchAPIView,
     QueryAPIView,
+    QueryStreamAPIView,
     query_retrieve_only,
+    embed,
     health,
     ClearAPIView,
 )
@@ -11,9 +14,12 @@ from .views import (
 urlpatterns = [
     # endpoint 1: Ingest (POST only for file upload/ingestion)
     path("ingest/", IngestAPIView.as_view(), name="ingest"),
+    path("ingest_batch/", IngestBatchAPIView.as_view(), name="ingest_batch"),
     # endpoint 2: Query (POST only for asking questions)
     path("query/", QueryAPIView.as_view(), name="query"),
+    path("query_stream/", QueryStreamAPIView.as_view(), name="query_stream"),
     path("query_retrieve/", query_retrieve_only, name="query_retrieve"),
+    path("embed/", embed, name="embed"),
     path("health/", health, name="health"),
     path("clear/", ClearAPIView.as_view(), name="api-clear"),
 ]
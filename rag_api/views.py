@@ -1,8 +1,16 @@
 # rag_api/views.py
+import hashlib
+import itertools
+import json
 import os
+import shutil
+import threading
 import time
 import requests
-from rag import RAGService
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from django.http import StreamingHttpResponse
+from rag import DB_DIR, RAGService
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
@@ -13,7 +21,66 @@ from pathlib import Path
 
 from .serializers import IngestSerializer, QuerySerializer
 
-rag_service = RAGService()
+
+@lru_cache(maxsize=1)
+def _svc() -> RAGService:
+    # built on first use, once per process (or once in the gunicorn master
+    # with preload_app, so forked workers share it copy-on-write);
+    # batch_queries: concurrent requests share one query-encode + scoring pass
+    return RAGService(batch_queries=True)
+
+
+def _sse(events):
+    # serialize answer(stream=True) events as Server-Sent Events; the status
+    # line is already sent, so a failure mid-stream becomes an "error" event
+    try:
+        for ev in events:
+            data = json.dumps(ev["data"], ensure_ascii=False)
+            yield f"event: {ev['event']}\ndata: {data}\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps(str(e), ensure_ascii=False)}\n\n"
+
+
+def _save_upload(uploaded_file, file_path: Path):
+    # large uploads are already spooled to a temp file by Django: move it
+    # into place (a rename, no bytes copied) when it's on the same device
+    if hasattr(uploaded_file, "temporary_file_path"):
+        try:
+            os.replace(uploaded_file.temporary_file_path(), file_path)
+            return
+        except OSError:
+            pass  # e.g. cross-device; fall back to copying
+    buf = getattr(uploaded_file.file, "getbuffer", None)
+    if buf is not None:
+        # in-memory upload (BytesIO): write() straight from its buffer, no
+        # intermediate copies; one syscall for any realistic size
+        with buf() as view, open(file_path, "wb", buffering=0) as destination:
+            done = 0
+            while done < len(view):
+                done += destination.write(view[done:])
+        return
+    # otherwise copy in 1 MiB blocks instead of Django's 64 KiB chunks()
+    uploaded_file.seek(0)
+    with open(file_path, "wb") as destination:
+        shutil.copyfileobj(uploaded_file, destination, length=1 << 20)
+
+
+def _stage_uploads(uploaded_files, persist: bool):
+    # -> (paths saved under ./data/, in-memory (name, bytes) blobs)
+    paths, blobs = [], []
+    for uploaded_file in uploaded_files:
+        if not persist and not hasattr(uploaded_file, "temporary_file_path"):
+            # small upload held in memory: parse it from there, no
+            # write + re-read through ./data/
+            blobs.append((uploaded_file.name, uploaded_file.read()))
+            continue
+        data_dir = Path("data")
+        data_dir.mkdir(exist_ok=True, parents=True)
+
+        file_path = data_dir / uploaded_file.name
+        _save_upload(uploaded_file, file_path)
+        paths.append(str(file_path))
+    return paths, blobs
 
 
 class IngestAPIView(APIView):
@@ -30,22 +97,19 @@ class IngestAPIView(APIView):
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        uploaded_file = serializer.validated_data["pdf_file"]
-
-        # 2. save the uploaded file to the data directory
-        data_dir = Path("data")
-        data_dir.mkdir(exist_ok=True, parents=True)
-
-        file_path = data_dir / uploaded_file.name
+        # several files may be sent under the same "pdf_file" field
+        uploaded_files = request.FILES.getlist("pdf_file") or [
+            serializer.validated_data["pdf_file"]
+        ]
+        persist = serializer.validated_data["persist"]
 
         try:
-            # handle the file in chunks to prevent large memory consumption
-            with open(file_path, "wb+") as destination:
-                for chunk in uploaded_file.chunks():
-                    destination.write(chunk)
+            # 2. save (or keep in memory) the uploaded files
+            paths, blobs = _stage_uploads(uploaded_files, persist)
 
-            # 3. call the core RAG ingestion logic
-            chunks_processed = rag_service.ingest_files([str(file_path)])
+            # 3. call the core RAG ingestion logic; all files go through one
+            # call, so PDF parsing fans out across processes
+            chunks_processed = _svc().ingest_files(paths, blobs=blobs)
 
             if chunks_processed > 0:
                 return Response(
@@ -53,7 +117,8 @@ class IngestAPIView(APIView):
                         "status": "success",
                         "message": "File ingested successfully.",
                         "chunks_processed": chunks_processed,
-                        "document_id": uploaded_file.name,
+                        "document_id": uploaded_files[0].name,
+                        "document_ids": [f.name for f in uploaded_files],
                     },
                     status=status.HTTP_201_CREATED,
                 )
@@ -77,12 +142,70 @@ class IngestAPIView(APIView):
             )
 
 
+class IngestBatchAPIView(APIView):
+    """
+    API endpoint for ingesting several PDFs (repeated "pdf_files" field) in one
+    request, reporting chunks processed per file.
+    """
+
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request, *args, **kwargs):
+        uploaded_files = request.FILES.getlist("pdf_files")
+        if not uploaded_files:
+            return Response(
+                {"status": "error", "message": "Field 'pdf_files' is required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        persist = str(request.data.get("persist", "")).lower() in ("1", "true", "yes")
+
+        try:
+            paths, blobs = _stage_uploads(uploaded_files, persist)
+            # one call: parsing fans out across processes, and the index is
+            # built once for the whole batch
+            per_doc = _svc().ingest_batch(paths, blobs=blobs)
+            results = []
+            for f in uploaded_files:
+                n = per_doc.get(f.name, 0)
+                results.append(
+                    {
+                        "filename": f.name,
+                        "chunks_processed": n,
+                        "status": "success" if n > 0 else "error",
+                    }
+                )
+            total = sum(per_doc.values())
+            return Response(
+                {
+                    "status": "success" if total > 0 else "error",
+                    "chunks_processed": total,
+                    "results": results,
+                },
+                status=(
+                    status.HTTP_201_CREATED
+                    if total > 0
+                    else status.HTTP_400_BAD_REQUEST
+                ),
+            )
+
+        except Exception as e:
+            return Response(
+                {
+                    "status": "error",
+                    "message": "Internal server error during processing.",
+                    "details": str(e),
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+
 class QueryAPIView(APIView):
     """
     API endpoint for asking questions against ingested documents.
     """
 
     parser_classes = (JSONParser,)
+    always_stream = False
 
     def post(self, request, *args, **kwargs):
         serializer = QuerySerializer(data=request.data)
@@ -103,7 +226,43 @@ class QueryAPIView(APIView):
             except Exception:
                 max_tokens = 750
 
-            result = rag_service.answer(
+            if self.always_stream or validated.get("stream", False):
+                # tokens are flushed as they are generated (SSE), so the
+                # client sees the first token instead of waiting for all.
+                # Retrieval runs inside answer(), and the stream is advanced
+                # to its first token here, so retrieval / model-load failures
+                # still get the JSON 500 below instead of a broken stream
+                events = _svc().answer(
+                    query=validated["query"],
+                    k=validated.get("k", 4),
+                    generate=gen,
+                    max_tokens=max_tokens,
+                    stream=True,
+                )
+                head = []
+                for ev in events:
+                    head.append(ev)
+                    if ev["event"] != "sources":
+                        break
+                if head and head[-1]["event"] == "error":
+                    return Response(
+                        {
+                            "status": "error",
+                            "message": "LLM generation failed. Check model file or llama-cpp installation.",
+                            "answer": head[-1]["data"],
+                            "sources": head[0]["data"],
+                        },
+                        status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    )
+                response = StreamingHttpResponse(
+                    _sse(itertools.chain(head, events)),
+                    content_type="text/event-stream",
+                )
+                response["Cache-Control"] = "no-cache"
+                response["X-Accel-Buffering"] = "no"  # disable nginx buffering
+                return response
+
+            result = _svc().answer(
                 query=validated["query"],
                 k=validated.get("k", 4),
                 generate=gen,
@@ -142,18 +301,52 @@ class QueryAPIView(APIView):
             )
 
 
+class QueryStreamAPIView(QueryAPIView):
+    """
+    Same as /query/, but always answers as text/event-stream: one "sources"
+    event, "token" events while the LLM generates, then "done".
+    """
+
+    always_stream = True
+
+
 @api_view(["POST"])
 def query_retrieve_only(request):
     try:
         query = (request.data or {}).get("query", "")
+        embedding = (request.data or {}).get("embedding")
         k = int((request.data or {}).get("k", 4))
-        if not query:
+        if not query and not embedding:
             return Response(
                 {"status": "error", "message": "Field 'query' is required."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        hits = rag_service.retrieve(query, k=k)
+        if embedding:
+            # client already has the vector (from /embed/): skip encoding
+            if not isinstance(embedding, list) or not all(
+                isinstance(x, (int, float)) and not isinstance(x, bool)
+                for x in embedding
+            ):
+                return Response(
+                    {
+                        "status": "error",
+                        "message": "Field 'embedding' must be a list of numbers.",
+                    },
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            dim = _svc().embedding_dim()
+            if len(embedding) != dim:
+                return Response(
+                    {
+                        "status": "error",
+                        "message": f"Field 'embedding' has dim {len(embedding)}, expected {dim}.",
+                    },
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            hits = _svc().retrieve_by_embedding(embedding, k=k)
+        else:
+            hits = _svc().retrieve(query, k=k)
 
         return Response(
             {"status": "success", "sources": hits}, status=status.HTTP_200_OK
@@ -166,40 +359,79 @@ def query_retrieve_only(request):
         )
 
 
-# health & config check
+@api_view(["POST"])
+def embed(request):
+    """
+    Returns the normalized embedding of "text", for /query_retrieve/'s "embedding".
+    """
+    text = (request.data or {}).get("text", "")
+    if not text:
+        return Response(
+            {"status": "error", "message": "Field 'text' is required."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    try:
+        emb = _svc().embed_query(text)
+        return Response(
+            {"status": "success", "embedding": emb.tolist(), "dim": int(emb.shape[0])},
+            status=status.HTTP_200_OK,
+        )
+    except Exception as e:
+        return Response(
+            {"status": "error", "message": str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        )
+
+
+# health & config check; env is read once at import, not per probe
+_BACKEND = os.getenv("RAG_STORAGE", "memory").lower()
+_QURL = os.getenv("QDRANT_URL", "http://127.0.0.1:6333").rstrip("/")
+_QCOLL = os.getenv("QDRANT_COLLECTION", "chunks")
+HEALTH_TTL_SEC = 2.0  # reuse a healthy Qdrant probe result for this long
+_HEALTH_CACHE = {"ts": 0.0, "val": None}
+_HEALTH_POOL = ThreadPoolExecutor(max_workers=3, thread_name_prefix="health")
+
+
 @api_view(["GET"])
 def health(request):
     """
     Returns current storage backend and (if Qdrant) a quick connectivity check.
     """
-    backend = os.getenv("RAG_STORAGE", "memory").lower()
-    info = {"status": "ok", "storage": backend}
-
-    if backend == "qdrant":
-        import requests
+    info = {"status": "ok", "storage": _BACKEND}
 
-        url = os.getenv("QDRANT_URL", "http://127.0.0.1:6333").rstrip("/")
-        coll = os.getenv("QDRANT_COLLECTION", "chunks")
+    if _BACKEND == "qdrant":
+        url, coll = _QURL, _QCOLL
         info["qdrant"] = {"url": url, "collection": coll}
 
+        now = time.monotonic()
+        cached = _HEALTH_CACHE["val"]
+        if cached is not None and now - _HEALTH_CACHE["ts"] < HEALTH_TTL_SEC:
+            # load balancers probe every second or so; don't amplify that
+            info["qdrant"] = dict(cached["qdrant"])
+            info["latency_ms"] = cached["latency_ms"]
+            return Response(info, status=status.HTTP_200_OK)
+
         try:
             start = time.time()
-            # 1) ping server root (fast)
-            r0 = requests.get(f"{url}/", timeout=5)
-            server_ok = r0.status_code == 200
-
-            # 2) check collection (also returns points_count)
-            r1 = requests.get(f"{url}/collections/{coll}", timeout=5)
-            collection_ok = r1.status_code == 200
+            # 1) ping server root (fast), 2) check collection, 3) count its
+            # points -- all in flight at once, so latency is the max not the sum
+            f0 = _HEALTH_POOL.submit(requests.get, f"{url}/", timeout=5)
+            f1 = _HEALTH_POOL.submit(
+                requests.get, f"{url}/collections/{coll}", timeout=5
+            )
+            fc = _HEALTH_POOL.submit(
+                requests.post,
+                f"{url}/collections/{coll}/points/count",
+                json={"exact": True},
+                timeout=5,
+            )
+            server_ok = f0.result().status_code == 200
+            collection_ok = f1.result().status_code == 200
             # use /points/count to get vectors
             points_count = 0
             if collection_ok:
                 try:
-                    rc = requests.post(
-                        f"{url}/collections/{coll}/points/count",
-                        json={"exact": True},
-                        timeout=5,
-                    )
+                    rc = fc.result()
                     if rc.status_code == 200:
                         points_count = rc.json().get("result", {}).get("count", 0)
                 except Exception:
@@ -210,6 +442,14 @@ def health(request):
             info["qdrant"]["points_count"] = points_count
             info["qdrant"]["alive"] = bool(server_ok and collection_ok)
             info["latency_ms"] = round((time.time() - start) * 1000, 2)
+            if info["qdrant"]["alive"]:
+                # only healthy results are reused, so an outage shows up
+                # on the very next probe
+                _HEALTH_CACHE["val"] = {
+                    "qdrant": dict(info["qdrant"]),
+                    "latency_ms": info["latency_ms"],
+                }
+                _HEALTH_CACHE["ts"] = time.monotonic()
 
         except Exception as e:
             info["qdrant"]["alive"] = False
@@ -219,8 +459,86 @@ def health(request):
 
 
 # POST /api/v1/clear/, drops and recreates the vector index (Qdrant) or clears memory store.
+# idempotency_key -> response body of recent clears, one file per key under
+# db/ so every gunicorn worker sees it: a repeated click replays the first
+# result instead of dropping the collection again
+CLEAR_DEDUPE_SEC = 60.0
+CLEAR_TOKEN_DIR = os.path.join(DB_DIR, "clear_tokens")
+
+
+def _clear_token_path(key: str) -> str:
+    name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return os.path.join(CLEAR_TOKEN_DIR, name + ".json")
+
+
+def _claim_clear(key: str):
+    # None: this request owns the clear; dict: body of the clear that already
+    # ran for this key (waits while another worker is still running it)
+    os.makedirs(CLEAR_TOKEN_DIR, exist_ok=True)
+    now = time.time()
+    for name in os.listdir(CLEAR_TOKEN_DIR):
+        p = os.path.join(CLEAR_TOKEN_DIR, name)
+        try:
+            if now - os.path.getmtime(p) > CLEAR_DEDUPE_SEC:
+                os.remove(p)
+        except OSError:
+            pass
+    path = _clear_token_path(key)
+    while True:
+        try:
+            # O_EXCL: exactly one worker gets to create the claim
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return None
+        except FileExistsError:
+            pass
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            continue  # owner failed and dropped its claim; try again
+        if raw:
+            return json.loads(raw)
+        try:
+            if time.time() - os.path.getmtime(path) > CLEAR_DEDUPE_SEC:
+                os.remove(path)  # owner died mid-clear; take over
+                continue
+        except OSError:
+            continue
+        time.sleep(0.1)  # empty claim: the owner's clear is still running
+
+
+def _finish_clear(key: str, body) -> None:
+    # body None: the clear failed, drop the claim so a retry runs it again
+    path = _clear_token_path(key)
+    if body is None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(body, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
 class ClearAPIView(APIView):
     def post(self, request):
-        result = clear_storage()
-        status_txt = "success" if result.get("ok") else "failed"
-        return Response({"status": status_txt, "result": result})
+        key = str((request.data or {}).get("idempotency_key") or "")
+        if key:
+            seen = _claim_clear(key)
+            if seen is not None:
+                return Response(dict(seen, deduplicated=True))
+
+        done = None
+        try:
+            result = clear_storage()
+            _svc().clear_query_cache()
+            status_txt = "success" if result.get("ok") else "failed"
+            body = {"status": status_txt, "result": result}
+            if result.get("ok"):
+                done = body
+        finally:
+            if key:
+                _finish_clear(key, done)
+        return Response(body)
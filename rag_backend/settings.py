@@ -46,7 +46,16 @@ INSTALLED_APPS = [
     "rag_api.apps.RagApiConfig",
 ]
 
+REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": [
+        "rag_api.renderers.OrjsonRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+}
+
 MIDDLEWARE = [
+    # first, so it compresses the final body (answer + hits JSON)
+    "rag_api.middleware.BufferedGZipMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -1,5 +1,6 @@
 # rag_backend/storage_factory.py
 import os
+from functools import lru_cache
 from .storage_qdrant import QdrantStorage
 from .storage_memory import MemoryStorage
 
@@ -9,6 +10,9 @@ from .storage_memory import MemoryStorage
 #                anything else -> MemoryStorage
 
 
+# Cached: one instance per process, so clear_storage() doesn't rebuild a
+# QdrantStorage (and redo its PUT + GET collection check) on every call.
+@lru_cache(maxsize=1)
 def get_storage():
     mode = os.environ.get("RAG_STORAGE", "memory").lower()
     if mode == "qdrant":
@@ -16,6 +20,11 @@ def get_storage():
     return MemoryStorage()
 
 
+def reset_storage_singleton():
+    # drop the cached instance, e.g. after changing RAG_STORAGE in tests
+    get_storage.cache_clear()
+
+
 # Unified clear/reset entry. Prefer .clear(); fallback to .reset().
 def clear_storage():
     s = get_storage()
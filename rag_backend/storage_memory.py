@@ -1,24 +1,198 @@
 # rag_backend/storage_memory.py
+import json
+import os
+import sys
+import numpy as np
+from filelock import FileLock
+
+try:  # optional: faster meta (de)serialization
+    import orjson
+except ImportError:
+    orjson = None
+
+SCAN_BLOCK_ROWS = 4096  # int8 rows dequantized per matmul during search
+# opt-in on-disk copy, memory-mapped so a restart maps the vectors instead
+# of re-ingesting: raw int8 rows, raw float32 scales, one JSON meta per line.
+# Unset (the default) keeps the store in RAM, private to each process
+MEM_DIR = os.getenv("RAG_MEM_DIR") or None
+MEM_Q8_FILE = "mem_index.q8"
+MEM_SCALE_FILE = "mem_index.scale.f32"
+MEM_META_FILE = "mem_meta.jsonl"
+# writers in every process sharing MEM_DIR (e.g. gunicorn workers) take it
+MEM_LOCK_FILE = "mem_index.lock"
+
+
+def _quantize_int8(v: np.ndarray):
+    # symmetric per-vector quantization: v ~= q * scale, q in [-127, 127]
+    scale = np.max(np.abs(v), axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    q = np.round(v / scale[:, None]).astype(np.int8)
+    return q, scale.astype(np.float32)
+
+
+def _dumps_line(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj) + b"\n"
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
 class MemoryStorage:
-    def __init__(self):
-        self._vecs = []  # e.g., list[list[float]]
+    def __init__(self, path: str | None = MEM_DIR):
+        # vectors are L2-normalized and kept as int8 codes plus a per-row
+        # float32 scale (4x less memory traffic than float32 rows);
+        # rows [:_n] are used, the rest is spare capacity.
+        # path: directory for the memory-mapped copy; None keeps it in RAM only
+        self._q: np.ndarray | None = None  # shape (capacity, d), int8
+        self._scale: np.ndarray | None = None  # shape (capacity,), float32
+        self._n = 0
         self._meta = []  # e.g., list[dict]
+        self._files = None
+        self._file_lock = None
+        self._sig = None  # meta file (size, mtime) as of our last load/write
+        if path is not None:
+            self._files = tuple(
+                os.path.join(path, f)
+                for f in (MEM_Q8_FILE, MEM_SCALE_FILE, MEM_META_FILE)
+            )
+            os.makedirs(path, exist_ok=True)
+            self._file_lock = FileLock(os.path.join(path, MEM_LOCK_FILE))
+            self._load()
+
+    def _meta_sig(self):
+        try:
+            st = os.stat(self._files[2])
+            return st.st_size, st.st_mtime_ns
+        except OSError:
+            return None
+
+    def _refresh(self):
+        # another process appended or reset since we last looked: remap
+        if self._files is not None and self._meta_sig() != self._sig:
+            self._load()
+
+    def _load(self):
+        q8_path, scale_path, meta_path = self._files
+        self._q = self._scale = None
+        self._n, self._meta = 0, []
+        self._sig = self._meta_sig()
+        if not all(os.path.exists(p) for p in self._files):
+            return
+        try:
+            with open(meta_path, "rb") as f:
+                loads = orjson.loads if orjson is not None else json.loads
+                meta = [loads(line) for line in f if line.strip()]
+            rows = os.path.getsize(scale_path) // 4
+            n = min(len(meta), rows)  # a torn upsert leaves extra rows/lines
+            if not n:
+                return
+            dim = os.path.getsize(q8_path) // rows
+            # pages fault in lazily on first search, so RSS stays low
+            self._q = np.memmap(q8_path, dtype=np.int8, mode="r+", shape=(rows, dim))
+            self._scale = np.memmap(
+                scale_path, dtype=np.float32, mode="r+", shape=(rows,)
+            )
+            self._n, self._meta = n, meta[:n]
+        except Exception as e:
+            print(f"[WARN] Ignoring unreadable memory index: {e}", file=sys.stderr)
+            self._q = self._scale = None
+            self._n, self._meta = 0, []
+
+    def _reserve_file(self, n: int, dim: int):
+        # grow both files to n rows (ftruncate) and remap them
+        q8_path, scale_path, _ = self._files
+        os.makedirs(os.path.dirname(q8_path) or ".", exist_ok=True)
+        self._q = self._scale = None  # drop the old maps before resizing
+        for p, size in ((q8_path, n * dim), (scale_path, n * 4)):
+            with open(p, "ab") as f:
+                os.ftruncate(f.fileno(), size)
+        self._q = np.memmap(q8_path, dtype=np.int8, mode="r+", shape=(n, dim))
+        self._scale = np.memmap(scale_path, dtype=np.float32, mode="r+", shape=(n,))
+
+    def _reserve(self, n: int, dim: int):
+        # grow by doubling, like a C++ vector, so upserts are amortized O(1)
+        cap = 0 if self._q is None else self._q.shape[0]
+        if n <= cap:
+            return
+        if self._files is not None:
+            return self._reserve_file(max(n, 2 * cap, 64), dim)
+        cap = max(n, 2 * cap, 64)
+        q = np.empty((cap, dim), dtype=np.int8)
+        scale = np.empty(cap, dtype=np.float32)
+        if self._n:
+            q[: self._n] = self._q[: self._n]
+            scale[: self._n] = self._scale[: self._n]
+        self._q, self._scale = q, scale
 
     def upsert(self, vectors, payloads):
-        self._vecs.extend(vectors)
+        v = np.asarray(vectors, dtype=np.float32)
+        if v.ndim != 2 or not len(v):
+            return {"ok": True, "count": 0}
+        v = v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-12)
+        q, scale = _quantize_int8(v)
+        if self._file_lock is None:
+            return self._append(q, scale, payloads)
+        with self._file_lock:
+            self._refresh()  # append after rows other processes wrote
+            return self._append(q, scale, payloads)
+
+    def _append(self, q: np.ndarray, scale: np.ndarray, payloads):
+        self._reserve(self._n + len(q), q.shape[1])
+        self._q[self._n : self._n + len(q)] = q
+        self._scale[self._n : self._n + len(q)] = scale
+        if self._files is not None:
+            self._q.flush()
+            self._scale.flush()
+            # metas last: on load, rows without a meta line are ignored
+            with open(self._files[2], "ab") as f:
+                f.write(b"".join(_dumps_line(p) for p in payloads))
+        self._n += len(q)
         self._meta.extend(payloads)
-        return {"ok": True, "count": len(vectors)}
+        if self._files is not None:
+            self._sig = self._meta_sig()
+        return {"ok": True, "count": len(q)}
+
+    def _scores(self, q: np.ndarray) -> np.ndarray:
+        # dequantize block by block so the float32 temporary stays
+        # cache-sized, then apply the per-row scale once
+        n = self._n
+        scores = np.empty(n, dtype=np.float32)
+        for s in range(0, n, SCAN_BLOCK_ROWS):
+            e = min(s + SCAN_BLOCK_ROWS, n)
+            scores[s:e] = self._q[s:e].astype(np.float32) @ q
+        scores *= self._scale[:n]
+        return scores
 
     def search(self, query_vec, k=5, filters=None):
-        # placeholder for demo use: first k items
-        hits = []
-        for i, meta in enumerate(self._meta[:k]):
-            hits.append({"id": i, "payload": meta, "score": 1.0})
-        return hits
+        # cosine top-k over the int8 rows, then argpartition
+        self._refresh()
+        if not self._n or k <= 0:
+            return []
+        q = np.asarray(query_vec, dtype=np.float32).ravel()
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        scores = self._scores(q)
+        k = min(k, self._n)
+        idx = np.argpartition(-scores, k - 1)[:k]
+        idx = idx[np.argsort(-scores[idx])]
+        meta = self._meta  # local name: no attribute lookup per hit
+        return [
+            {"id": i, "payload": meta[i], "score": s}
+            for i, s in zip(idx.tolist(), scores[idx].tolist())
+        ]
 
     def reset(self):
-        self._vecs.clear()
-        self._meta.clear()
+        if self._file_lock is None:
+            return self._reset()
+        with self._file_lock:
+            return self._reset()
+
+    def _reset(self):
+        self._q = self._scale = None
+        self._n = 0
+        self._meta = []
+        for p in self._files or ():
+            if os.path.exists(p):
+                os.unlink(p)
+        self._sig = None
         return {"ok": True, "storage": "memory", "reset": True}
 
     def clear(self):
@@ -1,8 +1,23 @@
 # rag_backend/storage_qdrant.py
+import json
 import os
+import threading
+import time
 import requests
+from itertools import islice
 from typing import List, Dict
-from uuid import uuid4  # to generate valid Qdrant id
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:  # optional: ~3-5x faster JSON for float-heavy bodies, numpy-aware
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from qdrant_client import QdrantClient, models  # optional gRPC transport
+except Exception:
+    QdrantClient = None
 
 QDRANT_URL = os.getenv("QDRANT_URL", "http://127.0.0.1:6333").rstrip(
     "/"
@@ -19,32 +34,120 @@ elif _dist_raw in ("euclid", "l2", "euclidean"):
     DISTANCE = "Euclid"
 else:
     DISTANCE = "Cosine"
+# optional: clear Qdrant collection on startup if env var is set
+RESET_ON_STARTUP = os.getenv("RESET_ON_STARTUP", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+QDRANT_BATCH = int(os.getenv("QDRANT_BATCH", "256"))  # points per upsert request
+# "grpc": upsert/search via qdrant-client over gRPC (packed float32 vectors
+# instead of JSON floats); anything else keeps the REST API
+QDRANT_TRANSPORT = os.getenv("QDRANT_TRANSPORT", "http").strip().lower()
+
+# one keep-alive connection pool per process (see _session), instead of a
+# fresh TCP (and TLS) handshake per request
+_SESSION = None
+_SESSION_PID = None
+_SESSION_LOCK = threading.Lock()
+
+
+def _session() -> requests.Session:
+    # keyed on the pid: a gunicorn worker forked from a master that already
+    # talked to Qdrant must not share its sockets (both would read each
+    # other's responses), so each process builds its own pool
+    global _SESSION, _SESSION_PID
+    pid = os.getpid()
+    if _SESSION_PID != pid:
+        with _SESSION_LOCK:
+            if _SESSION_PID != pid:
+                s = requests.Session()
+                s.headers["Connection"] = "keep-alive"
+                for scheme in ("http://", "https://"):
+                    s.mount(
+                        scheme,
+                        HTTPAdapter(
+                            pool_connections=4,
+                            pool_maxsize=16,
+                            max_retries=Retry(total=3, backoff_factor=0.2),
+                        ),
+                    )
+                _SESSION, _SESSION_PID = s, pid
+    return _SESSION
+
+
+_JSON_HDR = {"Content-Type": "application/json"}
+
+
+def _dumps(body) -> bytes:
+    # request body as bytes; numpy arrays are serialized without tolist()
+    if orjson is not None:
+        return orjson.dumps(body, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(body, separators=(",", ":"), default=lambda o: o.tolist()).encode(
+        "utf-8"
+    )
+
+
+def _loads(r: requests.Response):
+    return orjson.loads(r.content) if orjson is not None else r.json()
+
+
+def _bulk_ids(n: int) -> List[str]:
+    # n time-ordered UUIDv7 strings (valid Qdrant ids) from one urandom call:
+    # 48-bit ms timestamp, version 7, RFC 4122 variant, random remainder
+    buf = bytearray(os.urandom(16 * n))
+    ts = (int(time.time() * 1000) & ((1 << 48) - 1)).to_bytes(6, "big")
+    for j in range(6):
+        buf[j::16] = ts[j : j + 1] * n
+    buf[6::16] = bytes(0x70 | (b & 0x0F) for b in buf[6::16])
+    buf[8::16] = bytes(0x80 | (b & 0x3F) for b in buf[8::16])
+    h = buf.hex()
+    return [
+        f"{h[o:o+8]}-{h[o+8:o+12]}-{h[o+12:o+16]}-{h[o+16:o+20]}-{h[o+20:o+32]}"
+        for o in range(0, 32 * n, 32)
+    ]
 
 
 class QdrantStorage:
     def __init__(self):
-        # optional: clear Qdrant collection on startup if env var is set
-        reset_on_startup = os.getenv("RESET_ON_STARTUP", "false").lower() in (
-            "1",
-            "true",
-            "yes",
-        )
-        if reset_on_startup:
+        self._ensure_collection()
+        if RESET_ON_STARTUP:
+            # delete the points, not the collection, so its config survives
             try:
-                requests.delete(
-                    f"{QDRANT_URL}/collections/{QDRANT_COLLECTION}", timeout=10
-                )
+                self.clear()
                 print(
                     f"[INIT] Qdrant collection '{QDRANT_COLLECTION}' cleared on startup."
                 )
             except Exception as e:
                 print(f"[INIT] Qdrant clear failed: {e}")
-        self._ensure_collection()
+        self._grpc_on = QDRANT_TRANSPORT == "grpc"
+        if self._grpc_on and QdrantClient is None:
+            print("[INIT] qdrant-client not installed; using Qdrant REST API.")
+            self._grpc_on = False
+        # gRPC channels don't survive fork: built lazily, once per process
+        self._client_obj = None
+        self._client_pid = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def _client(self):
+        # qdrant-client for the gRPC transport, or None for REST
+        if not self._grpc_on:
+            return None
+        pid = os.getpid()
+        if self._client_pid != pid:
+            with self._client_lock:
+                if self._client_pid != pid:
+                    self._client_obj = QdrantClient(
+                        url=QDRANT_URL, prefer_grpc=True, timeout=30
+                    )
+                    self._client_pid = pid
+        return self._client_obj
 
     # Create-if-not-exists (idempotent). Qdrant returns 409 if already exists.
     def _ensure_collection(self) -> None:
         payload = {"vectors": {"size": EMBED_DIM, "distance": DISTANCE}}
-        r = requests.put(
+        r = _session().put(
             f"{QDRANT_URL}/collections/{QDRANT_COLLECTION}",
             json=payload,
             timeout=15,
@@ -52,29 +155,71 @@ class QdrantStorage:
         if r.status_code not in (200, 409):
             r.raise_for_status()
         # sanity check: ensure collection schema exists
-        rc = requests.get(f"{QDRANT_URL}/collections/{QDRANT_COLLECTION}", timeout=10)
+        rc = _session().get(f"{QDRANT_URL}/collections/{QDRANT_COLLECTION}", timeout=10)
         rc.raise_for_status()
 
     # to write into Qdrant
     def upsert(self, vectors, payloads):
-        points = []
-        for vec, pld in zip(vectors, payloads):
-            pid = str(uuid4())  # generate valid id for Qdrant
-            points.append(
-                {"id": pid, "vector": vec, "payload": pld}
-            )  # create a dict for (vec, pld) pairs and add to points list
-
-        r = requests.put(
-            f"{QDRANT_URL}/collections/{QDRANT_COLLECTION}/points",
-            json={"points": points},
-            timeout=30,
+        # sent in QDRANT_BATCH-sized requests; all but the last use
+        # wait=false so Qdrant indexes while we upload, and the final
+        # wait=true request returns once everything before it is applied
+        ids = _bulk_ids(min(len(vectors), len(payloads)))
+        if self._client is not None:
+            return self._upsert_grpc(ids, vectors, payloads)
+        points = (
+            {"id": pid, "vector": vec, "payload": pld}
+            for pid, vec, pld in zip(ids, vectors, payloads)
         )
-        if r.status_code >= 400:
-            print(">>> Qdrant upsert error", r.status_code, r.text)
-        r.raise_for_status()
-        return r.json()
+        batch = list(islice(points, QDRANT_BATCH))
+        result = {"status": "ok", "result": None}
+        while batch:
+            nxt = list(islice(points, QDRANT_BATCH))
+            r = _session().put(
+                f"{QDRANT_URL}/collections/{QDRANT_COLLECTION}/points",
+                params={"wait": "false" if nxt else "true"},
+                data=_dumps({"points": batch}),
+                headers=_JSON_HDR,
+                timeout=30,
+            )
+            if r.status_code >= 400:
+                print(">>> Qdrant upsert error", r.status_code, r.text)
+            r.raise_for_status()
+            result = _loads(r)
+            batch = nxt
+        return result
+
+    def _upsert_grpc(self, ids, vectors, payloads):
+        # same batching and wait semantics as the REST path
+        status = None
+        for s in range(0, len(ids), QDRANT_BATCH):
+            e = s + QDRANT_BATCH
+            res = self._client.upsert(
+                collection_name=QDRANT_COLLECTION,
+                points=models.Batch(
+                    ids=ids[s:e], vectors=list(vectors[s:e]), payloads=payloads[s:e]
+                ),
+                wait=e >= len(ids),
+            )
+            status = str(res.status)
+        return {"status": "ok", "result": {"status": status}}
+
+    def search(self, query_vec, k: int = 5, filters: Dict = None):
+        # query_vec: list of floats or a 1-D numpy array
+        if self._client is not None:
+            res = self._client.query_points(
+                collection_name=QDRANT_COLLECTION,
+                query=[float(x) for x in query_vec],
+                limit=k,
+                with_payload=True,
+                with_vectors=False,
+                query_filter=models.Filter(**filters) if filters else None,
+            )
+            # same hit shape as the REST response
+            return [
+                {"id": p.id, "score": p.score, "payload": p.payload or {}}
+                for p in res.points
+            ]
 
-    def search(self, query_vec: List[float], k: int = 5, filters: Dict = None):
         body = {
             "vector": query_vec,
             "limit": k,
@@ -84,44 +229,71 @@ class QdrantStorage:
         if filters:
             body["filter"] = filters
 
-        r = requests.post(
+        r = _session().post(
             f"{QDRANT_URL}/collections/{QDRANT_COLLECTION}/points/search",
-            json=body,
+            data=_dumps(body),
+            headers=_JSON_HDR,
             timeout=30,
         )
         r.raise_for_status()
-        return r.json().get("result", [])
-
-    def _wait_deleted(self, timeout_sec: int = 20):
-        """Poll until the collection is actually gone (DELETE may be async 202)."""
-        import time
+        return _loads(r).get("result", [])
 
-        deadline = time.time() + timeout_sec
-        while time.time() < deadline:
-            gr = requests.get(
-                f"{QDRANT_URL}/collections/{QDRANT_COLLECTION}", timeout=5
+    def search_batch(self, query_vecs, ks: List[int]) -> List[List[Dict]]:
+        # one round trip for several searches (the API's micro-batches)
+        if self._client is not None:
+            res = self._client.query_batch_points(
+                collection_name=QDRANT_COLLECTION,
+                requests=[
+                    models.QueryRequest(
+                        query=[float(x) for x in v],
+                        limit=k,
+                        with_payload=True,
+                        with_vector=False,
+                    )
+                    for v, k in zip(query_vecs, ks)
+                ],
             )
-            if gr.status_code == 404:
-                return True
-            time.sleep(0.3)
-        return False
+            return [
+                [
+                    {"id": p.id, "score": p.score, "payload": p.payload or {}}
+                    for p in r.points
+                ]
+                for r in res
+            ]
 
-    def clear(self) -> Dict:
-        """
-        Clear all points in the existing collection without touching its schema.
-        This avoids subtle DROP + CREATE issues and keeps vectors_config unchanged.
-        """
         body = {
-            "filter": {
-                # empty "must" matches all points in the collection
-                "must": []
-            }
+            "searches": [
+                {"vector": v, "limit": k, "with_payload": True, "with_vectors": False}
+                for v, k in zip(query_vecs, ks)
+            ]
         }
-        r = requests.post(
-            f"{QDRANT_URL}/collections/{QDRANT_COLLECTION}/points/delete",
-            json=body,
+        r = _session().post(
+            f"{QDRANT_URL}/collections/{QDRANT_COLLECTION}/points/search/batch",
+            data=_dumps(body),
+            headers=_JSON_HDR,
             timeout=30,
         )
         r.raise_for_status()
+        return _loads(r).get("result", [])
+
+    def clear(self) -> Dict:
+        """
+        Clear all points in the existing collection without touching its schema.
+        vectors_config, HNSW parameters and payload indexes all survive, so the
+        next upsert doesn't start from a cold collection (no DROP + CREATE).
+        """
+        # match-all filters, tried in order: older/newer Qdrant versions
+        # differ in which of these they accept
+        for flt in ({"must": []}, {"must_not": []}, {}):
+            r = _session().post(
+                f"{QDRANT_URL}/collections/{QDRANT_COLLECTION}/points/delete",
+                params={"wait": "true"},
+                data=_dumps({"filter": flt}),
+                headers=_JSON_HDR,
+                timeout=30,
+            )
+            if r.status_code not in (400, 422):
+                break
+        r.raise_for_status()
 
         return {"ok": True, "collection": QDRANT_COLLECTION, "reset": True}
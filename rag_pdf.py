@@ -0,0 +1,48 @@
+# rag_pdf.py -- PDF text extraction for rag.load_pdfs
+# Kept free of import side effects (no model, no storage): the extraction
+# pool's forkserver/spawn children import this module, not rag
+import io, os, re, sys
+from typing import Tuple
+from pypdf import PdfReader
+
+try:  # optional: PDFium (C++) text extraction, much faster than pure-Python pypdf
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+
+def _extract_text_pdfium(src) -> str:
+    pdf = pdfium.PdfDocument(src)
+    try:
+        pages = []
+        for page in pdf:
+            textpage = page.get_textpage()
+            pages.append(textpage.get_text_range().replace("\r\n", "\n"))
+            textpage.close()
+            page.close()
+        return "\n".join(pages)
+    finally:
+        pdf.close()
+
+
+def extract_text(src, name: str | None = None) -> str:
+    # src: a file path, or the PDF's raw bytes (parsed without touching disk)
+    name = name or src
+    if pdfium is not None:
+        try:
+            return _extract_text_pdfium(src)
+        except Exception as e:
+            print(f"[WARN] PDFium failed on {name}, using pypdf: {e}", file=sys.stderr)
+    reader = PdfReader(io.BytesIO(src) if isinstance(src, bytes) else src)
+    return "\n".join((page.extract_text() or "") for page in reader.pages)
+
+
+def extract_one(path: str, data: bytes | None = None) -> Tuple[str, str | None]:
+    # top-level (picklable) so it can run inside a worker process
+    try:
+        text = extract_text(path if data is None else data, name=path)
+        text = re.sub(r"\s+\n", "\n", text).strip()
+        return os.path.basename(path), text
+    except Exception as e:
+        print(f"[WARN] Failed to read {path}: {e}", file=sys.stderr)
+        return os.path.basename(path), None
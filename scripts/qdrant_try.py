@@ -1,12 +1,22 @@
 import os, json, requests, numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from requests.adapters import HTTPAdapter
 
 QDRANT = os.getenv("QDRANT_URL", "http://127.0.0.1:6333")
 COL = os.getenv("QDRANT_COLLECTION", "chunks")
 DIM = 384
+BATCH_SIZE = 16  # points per upsert request
+MAX_IN_FLIGHT = 2  # concurrent upsert requests
+
+# one pooled keep-alive session for every call instead of a new connection each
+S = requests.Session()
+S.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=3))
+S.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=3))
 
 
 def ensure_collection():
-    r = requests.put(
+    r = S.put(
         f"{QDRANT}/collections/{COL}",
         json={"vectors": {"size": DIM, "distance": "Cosine"}},
     )
@@ -14,6 +24,18 @@ def ensure_collection():
         raise SystemExit(f"ensure_collection failed: {r.status_code} {r.text}")
 
 
+def _batches(points, size=BATCH_SIZE):
+    it = iter(points)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+def _upsert(batch):
+    r = S.put(f"{QDRANT}/collections/{COL}/points", json={"points": batch})
+    r.raise_for_status()
+    return r.json()
+
+
 def insert_points():
     v1 = np.random.randn(DIM).astype("float32").tolist()
     v2 = np.random.randn(DIM).astype("float32").tolist()
@@ -29,14 +51,14 @@ def insert_points():
             "payload": {"doc_id": "demo", "chunk_index": 1, "text": "second chunk"},
         },
     ]
-    r = requests.put(f"{QDRANT}/collections/{COL}/points", json={"points": points})
-    r.raise_for_status()
-    print("upsert ok:", r.json())
+    with ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT) as ex:
+        for res in ex.map(_upsert, _batches(points)):
+            print("upsert ok:", res)
 
 
 def search():
     qvec = np.random.randn(DIM).astype("float32").tolist()
-    r = requests.post(
+    r = S.post(
         f"{QDRANT}/collections/{COL}/points/search", json={"vector": qvec, "limit": 5}
     )
     r.raise_for_status()
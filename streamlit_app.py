@@ -1,25 +1,263 @@
+import json
 import os
+import sys
 import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import numpy as np
 import streamlit as st
 import requests
-from streamlit.components.v1 import html as st_html
-from pathlib import Path
-from typing import Dict, Any
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+
+try:  # optional: HTTP/2 client, multiplexes calls over one connection
+    import httpx
+except ImportError:
+    httpx = None
 
 # replace RAG core methods with HTTP requests
-API_BASE_URL = "http://127.0.0.1:8000/api/v1"
+API_BASE_URL = os.getenv("RAG_API_BASE_URL", "http://127.0.0.1:8000/api/v1")
 INGEST_URL = f"{API_BASE_URL}/ingest/"
+INGEST_BATCH_URL = f"{API_BASE_URL}/ingest_batch/"
 QUERY_URL = f"{API_BASE_URL}/query/"
+QUERY_STREAM_URL = f"{API_BASE_URL}/query_stream/"
 QUERY_RETRIEVE_URL = f"{API_BASE_URL}/query_retrieve/"
+EMBED_URL = f"{API_BASE_URL}/embed/"
+URL_BY_MODE = {True: QUERY_RETRIEVE_URL, False: QUERY_URL}  # keyed by 'dry'
+INGEST_TIMEOUT = 120  # seconds per uploaded file
+QUERY_TIMEOUT = 900  # seconds; generation on CPU can be slow
+INGEST_WORKERS = 4  # concurrent PDF uploads
+SEM_CACHE_SIZE = 128  # answers kept per browser session for near-duplicate questions
+
+
+# one pooled keep-alive session per Streamlit server process, instead of a
+# new TCP connection to Django for every call
+@st.cache_resource
+def get_session() -> requests.Session:
+    s = requests.Session()
+    a = HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504]
+        ),
+    )
+    s.mount("http://", a)
+    s.mount("https://", a)
+    # every encoding urllib3 can decode here (gzip, deflate, plus br / zstd
+    # when brotli / zstandard are installed); responses are decoded
+    # transparently
+    s.headers.update(make_headers(accept_encoding=True))
+    return s
+
+
+# HTTP/2 client for the JSON calls (query, embed, health, clear), or None to
+# use the requests Session. h2 is only negotiated over TLS (ALPN), i.e. an
+# https API_BASE_URL served by an h2-capable ASGI server; runserver and
+# gunicorn speak HTTP/1.1 only, so they keep the Session.
+@st.cache_resource
+def get_client():
+    if httpx is None or not API_BASE_URL.startswith("https://"):
+        return None
+    try:
+        c = httpx.Client(
+            http2=True,
+            timeout=httpx.Timeout(connect=3, read=QUERY_TIMEOUT, write=120, pool=5),
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=8),
+        )
+        if c.get(f"{API_BASE_URL}/health/").http_version == "HTTP/2":
+            return c
+        c.close()
+    except Exception as e:  # e.g. h2 not installed, backend down
+        print(f"[WARN] HTTP/2 client unavailable, using requests: {e}", file=sys.stderr)
+    return None
+
+
+def _http():
+    # either client: both have get/post(url, json=, timeout=) and .json()
+    return get_client() or get_session()
+
+
+def _post_json(url: str, payload: dict, timeout: float) -> dict:
+    """POST JSON and return the parsed body, with requests-style errors."""
+    client = get_client()
+    if client is None:
+        r = get_session().post(url, json=payload, timeout=timeout)
+        r.raise_for_status()
+        return r.json()
+    try:
+        r = client.post(url, json=payload, timeout=timeout)
+    except httpx.TransportError as e:
+        raise requests.exceptions.ConnectionError(str(e)) from e
+    if r.status_code >= 400:
+        # callers read e.response.status_code / .json() / .text, which an
+        # httpx.Response has too
+        raise requests.exceptions.HTTPError(f"{r.status_code} for {url}", response=r)
+    return r.json()
 
 
-# backend clear helper: Call Django /api/v1/clear/ and return JSON result.
-def clear_index_backend() -> dict:
-    r = requests.post(f"{API_BASE_URL}/clear/", timeout=30)
-    r.raise_for_status()
+def _post_query(url: str, payload_items: tuple) -> dict:
+    # errors carry the response, and are never cached
+    return _post_json(url, dict(payload_items), QUERY_TIMEOUT)
+
+
+# repeated (query, k, model, max_tokens, dry) requests answer from here
+# instead of re-running retrieval + the LLM on the backend
+@st.cache_data(ttl=600, max_entries=256, show_spinner=False)
+def run_query(url: str, payload_items: tuple) -> dict:
+    return _post_query(url, payload_items)
+
+
+# query vectors are deterministic: retries of the same question (new k,
+# retrieve-only re-runs) reuse the vector instead of re-embedding it
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False)
+def embed(text: str) -> tuple:
+    return tuple(_post_json(EMBED_URL, {"text": text}, 60)["embedding"])
+
+
+def sem_cache_lookup(q_vec: np.ndarray, params: tuple, tau: float):
+    """Cached response for a question within cosine tau of q_vec, or None."""
+    cache = st.session_state.setdefault("sem_cache", [])
+    cands = [i for i, e in enumerate(cache) if e["params"] == params]
+    if not cands:
+        return None
+    sims = np.stack([cache[i]["vec"] for i in cands]) @ q_vec  # unit vectors
+    best = int(np.argmax(sims))
+    if sims[best] < tau:
+        return None
+    entry = cache.pop(cands[best])
+    cache.append(entry)  # most recently used last
+    return dict(entry["data"], sem_sim=round(float(sims[best]), 4))
+
+
+def sem_cache_store(q_vec: np.ndarray, params: tuple, data: dict):
+    cache = st.session_state.setdefault("sem_cache", [])
+    cache.append({"vec": q_vec, "params": params, "data": data, "ts": time.time()})
+    del cache[:-SEM_CACHE_SIZE]  # evict least recently used
+
+
+def forget_answers():
+    # the index changed: cached answers may cite stale or missing chunks
+    st.session_state.pop("sem_cache", None)
+    run_query.clear()
+
+
+def stream_query(payload: dict, box, start_ts: float):
+    """POST to /query_stream/, rendering tokens into box as they arrive.
+
+    Returns the same shape as /query/ plus first_token_ms, or None on 404.
+    Raises HTTPError like run_query() for error statuses, and RuntimeError
+    for an "error" event or a stream that ends without "done".
+    """
+    with get_session().post(
+        QUERY_STREAM_URL, json=payload, stream=True, timeout=QUERY_TIMEOUT
+    ) as r:
+        if r.status_code == 404:
+            return None
+        if r.status_code != 200:
+            r.content  # read the body before the connection is released
+            r.raise_for_status()
+        r.encoding = "utf-8"  # SSE is always UTF-8
+        out = {"answer": "", "sources": [], "used": {}, "first_token_ms": None}
+        buf, event, done = [], None, False
+        # chunked replies (gunicorn) are handed over chunk by chunk; a plain
+        # read-until-close body (runserver) must be read bytewise, or
+        # urllib3 would wait for 512 bytes / EOF before yielding anything
+        chunked = r.headers.get("Transfer-Encoding", "").lower() == "chunked"
+        lines = r.iter_lines(chunk_size=None if chunked else 1, decode_unicode=True)
+        for line in lines:
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[5:])
+                if event == "token":
+                    if out["first_token_ms"] is None:
+                        out["first_token_ms"] = round(
+                            (time.time() - start_ts) * 1000, 1
+                        )
+                    buf.append(data)
+                    box.markdown("".join(buf))
+                elif event == "sources":
+                    out["sources"] = data
+                elif event == "done":
+                    out["used"] = data
+                    done = True
+                elif event == "error":
+                    raise RuntimeError(f"Answer stream failed: {data}")
+        if not done:
+            raise RuntimeError("Answer stream ended before completion.")
+        out["answer"] = "".join(buf)
+        return out
+
+
+def error_data(response) -> dict:
+    """Report a failed /query/ or /query_stream/ reply; returns its JSON body.
+
+    An LLM failure (500) falls back to the sources in the body; any other
+    error stops the run.
+    """
+    # parse the error body once; branches below reuse it
+    try:
+        data = response.json()
+    except ValueError:
+        data = {}
+    # check connection error
+    if response.status_code == 500:
+        # 500 could be LLM failure, see message/details
+        if "LLM generation failed" in data.get("message", ""):
+            st.error(
+                f"LLM Generation Failed (Check Model Config). Details: {data.get('details') or data.get('answer', '')}"
+            )
+            return data
+        raise Exception(f"Backend 500 Error: {data.get('details', 'Unknown error')}")
+    st.error(
+        f"API Request Failed. Status: {response.status_code}. Detail: {response.text}"
+    )
+    st.stop()
+
+
+# /health/ probe, run on a background thread so the page renders while it
+# is in flight; transient connection errors are retried by the Session's
+# urllib3 Retry
+HEALTH_TTL_SEC = 5.0  # reruns within this window reuse the last probe
+
+
+@st.cache_resource
+def _health_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="health")
+
+
+def _probe_health(client) -> dict:
+    r = client.get(f"{API_BASE_URL}/health/", timeout=3)
     return r.json()
 
 
+def invalidate_health():
+    # the index changed: the next badge render probes live
+    st.session_state.pop("health_future", None)
+
+
+def health_future() -> Future:
+    """This session's current /health/ probe; a new one once the last is stale."""
+    fut = st.session_state.get("health_future")
+    if (
+        fut is None
+        or time.time() - st.session_state["health_probe_ts"] >= HEALTH_TTL_SEC
+    ):
+        # the client is resolved here: cache_resource needs the script thread
+        fut = _health_pool().submit(_probe_health, _http())
+        st.session_state["health_future"] = fut
+        st.session_state["health_probe_ts"] = time.time()
+    return fut
+
+
+# backend clear helper: Call Django /api/v1/clear/ and return JSON result.
+def clear_index_backend(token: str) -> dict:
+    # the token makes retries / double clicks idempotent on the backend
+    return _post_json(f"{API_BASE_URL}/clear/", {"idempotency_key": token}, 30)
+
+
 # try:
 #    from rag import ingest_files, answer
 # except ImportError:
@@ -36,70 +274,66 @@ st.caption(f"Streamlit version: {st.__version__}")
 # Health banner
 colA, colB = st.columns([1, 1])
 
-with colA:
-    health_box = st.empty()
+# start the probe now; the badge is filled in at the end of the script,
+# after the rest of the page has been sent to the browser
+health_future()
+
+# only this fragment reruns on the 10s tick, not the whole page; the
+# schedule pauses while a request is in flight
+_auto = st.session_state.get("auto_health", False)
+_busy = st.session_state.get("busy", False)
+
+
+@st.fragment(run_every=10 if _auto and not _busy else None)
+def health_fragment():
+    """Wait for the /health probe and render one-line badge."""
+    try:
+        j = health_future().result(timeout=10)
+        if not isinstance(j, dict):
+            raise RuntimeError("health fetch failed")
+
+        storage = j.get("storage", "unknown")
+        alive = (j.get("qdrant") or {}).get("alive", None)
+        badge = f"Backend: **{storage}**"
+        if alive is True:
+            badge += " • Qdrant: ✅"
+        elif alive is False:
+            badge += " • Qdrant: ❌"
+        else:
+            badge += " • Qdrant: ⚪"
+        points = (j.get("qdrant") or {}).get("points_count", None)
+        if points is not None:
+            badge += f" • vectors: {points}"
+        latency = j.get("latency_ms", None)
+        if latency is not None:
+            badge += f" • latency: {latency} ms"
+        st.caption(badge)
+    except Exception:
+        st.caption("Backend: unreachable")
 
-    def render_health_once():
-        """Fetch /health and render one-line badge into health_box."""
-        try:
-            # quick retries for first-load， add ts + no-cache to avoid caching
-            j = None
-            for _ in range(3):
-                try:
-                    r = requests.get(
-                        f"{API_BASE_URL}/health/?_={int(time.time())}",
-                        headers={"Cache-Control": "no-cache"},
-                        timeout=3,
-                    )
-                    j = r.json()
-                    break
-                except Exception:
-                    time.sleep(0.4)
-            if not isinstance(j, dict):
-                raise RuntimeError("health fetch failed")
-
-            storage = j.get("storage", "unknown")
-            alive = (j.get("qdrant") or {}).get("alive", None)
-            badge = f"Backend: **{storage}**"
-            if alive is True:
-                badge += " • Qdrant: ✅"
-            elif alive is False:
-                badge += " • Qdrant: ❌"
-            else:
-                badge += " • Qdrant: ⚪"
-            points = (j.get("qdrant") or {}).get("points_count", None)
-            if points is not None:
-                badge += f" • vectors: {points}"
-            latency = j.get("latency_ms", None)
-            if latency is not None:
-                badge += f" • latency: {latency} ms"
-            health_box.caption(badge)
-        except Exception:
-            health_box.caption("Backend: unreachable")
-
-    # render once per run
-    render_health_once()
 
 with colB:
-    auto = st.toggle(
+    st.toggle(
         "Auto-refresh health (10s)",
         value=False,
-        key="health_toggle_nonblocking",
+        key="auto_health",
         help="Auto-refresh the health banner without blocking the page.",
     )
 
 
-# schedule non-blocking reruns every 10s (pause when busy)
-busy = st.session_state.get("busy", False)
-if auto and not busy:
-    st.markdown("<meta http-equiv='refresh' content='10'/>", unsafe_allow_html=True)
-
-
 # Settings Expander
 with st.expander("Configuration Settings", expanded=True):
     model = st.text_input("LLM Model (.gguf filename - Read by Django)", value="")
     # Using 'Top-K' for professional retrieval terminology
     k = st.slider("Retrieval Top-K Chunks", 1, 8, 4)
+    sem_tau = st.slider(
+        "Semantic cache threshold (cosine)",
+        0.80,
+        1.00,
+        0.92,
+        0.01,
+        help="Reuse a previous answer when a new question is at least this similar.",
+    )
 
 
 # Maintenance section: clear index button
@@ -126,10 +360,14 @@ with st.container(border=True):
         st.session_state["busy"] = True  # pause autorefresh
         try:
             with st.spinner("Clearing index..."):
-                result = clear_index_backend()
+                result = clear_index_backend(
+                    st.session_state.setdefault("clear_token", str(uuid.uuid4()))
+                )
             ok = bool(result.get("result", {}).get("ok"))
             if ok:
                 st.success("Index cleared successfully.")
+                st.session_state.pop("clear_token", None)  # next clear is a new one
+                forget_answers()
             else:
                 st.warning(f"Clear API returned: {result}")
         except requests.HTTPError as e:
@@ -138,6 +376,7 @@ with st.container(border=True):
             st.error(f"Failed to clear index: {e}")
         finally:
             st.session_state["busy"] = False
+            invalidate_health()
             st.rerun()  # immediate light refresh to update health
 
 # 1) Upload and Ingestion calling Django Ingest API
@@ -165,51 +404,94 @@ if ingest_btn:
 
         progress = st.progress(0, text=f"Uploading 0/{total}")
 
-        for idx, uploaded_file in enumerate(uploaded_files, start=1):
-            with st.spinner(f"Uploading {uploaded_file.name} ({idx}/{total})..."):
-
-                file_bytes = uploaded_file.read()
-                files = {
-                    "pdf_file": (
-                        uploaded_file.name,
-                        file_bytes,
-                        "application/pdf",
-                    )
-                }
-
-                response = requests.post(INGEST_URL, files=files, timeout=120)
-
-            if response.status_code in (200, 201):
+        # take read-only views of the uploads on this thread (UploadedFile
+        # isn't thread-safe): a memoryview over Streamlit's buffer, so the
+        # PDF bytes aren't copied again before requests builds the body
+        blobs = [(f.name, f.getbuffer()) for f in uploaded_files]
+        session = get_session()
+        with st.spinner(f"Uploading {total} file(s)..."):
+            # one multipart request for the whole selection; the backend
+            # parses the PDFs in parallel and builds the index once
+            response = session.post(
+                INGEST_BATCH_URL,
+                files=[
+                    ("pdf_files", (name, data, "application/pdf"))
+                    for name, data in blobs
+                ],
+                # the backend answers only after embedding every file
+                timeout=INGEST_TIMEOUT * len(blobs),
+            )
+            if response.status_code != 404:
                 try:
-                    data = response.json()
+                    results = response.json().get("results") or []
                 except Exception:
-                    data = {}
-                ok_cnt += 1
-                chunks = int(data.get("chunks_processed", 0))
-                total_chunks += chunks
-                st.toast(
-                    f"✅ {uploaded_file.name} — processed {chunks} chunks.", icon="✅"
-                )
-            else:
-                fail_cnt += 1
-                st.toast(
-                    f"❌ {uploaded_file.name} — {response.status_code}: {response.text[:200]}",
-                    icon="❌",
-                )
-
-            progress.progress(idx / total, text=f"Uploading {idx}/{total}")
+                    results = []
+                if not results:
+                    fail_cnt = total
+                    st.toast(
+                        f"❌ {response.status_code}: {response.text[:200]}",
+                        icon="❌",
+                    )
+                for idx, r in enumerate(results, start=1):
+                    name = r.get("filename", "?")
+                    chunks = int(r.get("chunks_processed", 0))
+                    if r.get("status") == "success":
+                        ok_cnt += 1
+                        total_chunks += chunks
+                        st.toast(f"✅ {name} — processed {chunks} chunks.", icon="✅")
+                    else:
+                        fail_cnt += 1
+                        st.toast(f"❌ {name} — no chunks extracted.", icon="❌")
+                    progress.progress(idx / total, text=f"Uploading {idx}/{total}")
+        if response.status_code == 404:
+            # older backend without /ingest_batch/: one request per file
+            with st.spinner(f"Uploading {total} file(s)..."):
+                with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as ex:
+                    futures = {
+                        ex.submit(
+                            session.post,
+                            INGEST_URL,
+                            files={"pdf_file": (name, data, "application/pdf")},
+                            timeout=INGEST_TIMEOUT,
+                        ): name
+                        for name, data in blobs
+                    }
+                    for idx, fut in enumerate(as_completed(futures), start=1):
+                        name = futures[fut]
+                        response = fut.result()
+                        if response.status_code in (200, 201):
+                            try:
+                                data = response.json()
+                            except Exception:
+                                data = {}
+                            ok_cnt += 1
+                            chunks = int(data.get("chunks_processed", 0))
+                            total_chunks += chunks
+                            st.toast(
+                                f"✅ {name} — processed {chunks} chunks.", icon="✅"
+                            )
+                        else:
+                            fail_cnt += 1
+                            st.toast(
+                                f"❌ {name} — {response.status_code}: {response.text[:200]}",
+                                icon="❌",
+                            )
+
+                        progress.progress(idx / total, text=f"Uploading {idx}/{total}")
 
         if ok_cnt > 0:
+            forget_answers()
             st.success(
                 f"Completed: {ok_cnt}/{total} file(s) ingested, total {total_chunks} chunks."
             )
         if fail_cnt > 0:
             st.warning(f"{fail_cnt}/{total} file(s) failed.")
 
-        # give toast/success messages time to be visible
-        time.sleep(2)
-        # rerun to update，health vectors
-        st.rerun()
+        # rerun to update，health vectors, once the toast/success messages
+        # have been visible for a moment; scheduled, not slept, so the
+        # script finishes now
+        invalidate_health()
+        st.session_state["pending_rerun_at"] = time.time() + 2.0
 
     except requests.exceptions.ConnectionError:
         st.error(
@@ -225,11 +507,17 @@ if ingest_btn:
 st.subheader("2) Query Documents")
 q = st.text_input("Enter your question here")
 
-col1, col2 = st.columns([1, 1])
+col1, col2, col3 = st.columns([1, 1, 1])
 with col1:
     run_btn = st.button("Generate Answer")
 with col2:
     dry = st.checkbox("Retrieve only (Skip LLM Generation)", value=False)
+with col3:
+    bypass_cache = st.checkbox(
+        "Bypass cache",
+        value=False,
+        help="Always ask the backend instead of reusing a cached answer.",
+    )
 
 show_retrieval = st.toggle(
     "Show retrieval details",
@@ -247,90 +535,86 @@ max_tokens = st.slider(
     help="Upper bound for generated answer length; increase if answers are cut off.",
 )
 
-if run_btn and q.strip():
+q_clean = q.strip()
+if run_btn and q_clean:
+    model_clean = model.strip()
     try:
         with st.spinner("Querying Django API and processing response..."):
             start_ts = time.time()  # timing starts
             # prepare JSON Payload for user input
             payload = {
-                "query": q.strip(),
+                "query": q_clean,
                 "k": k,
                 "generate": not dry,
+                **({"model": model_clean} if model_clean else {}),
+                "max_tokens": int(max_tokens),
             }
 
-            if model.strip():
-                payload["model"] = model.strip()
-
-            payload["max_tokens"] = int(max_tokens)
-
-            # send POST request to Django Query API, choose endpoint by 'dry' flag
-            url = QUERY_RETRIEVE_URL if dry else QUERY_URL
-            response = requests.post(url, json=payload, timeout=900)
-
-            # check connection error
-            if response.status_code == 500:
-                # 500 could be LLM failure, parse JSON to get detailed info
-                data = response.json()
-                if "LLM generation failed" in data.get("message", ""):
-                    st.error(
-                        f"LLM Generation Failed (Check Model Config). Details: {data['details']}"
-                    )
-                    res = {
-                        "answer": data.get("answer", ""),
-                        "hits": data.get("sources", []),
-                    }  # fallback here
-                else:
-                    raise Exception(
-                        f"Backend 500 Error: {data.get('details', 'Unknown error')}"
+            data = None
+            sem_vec = None
+            sem_params = (k, model_clean, payload["max_tokens"])
+            if not dry and not bypass_cache:
+                # paraphrased re-asks are answered from this session's cache,
+                # without another LLM call
+                try:
+                    sem_vec = np.asarray(embed(q_clean), dtype=np.float32)
+                    data = sem_cache_lookup(sem_vec, sem_params, sem_tau)
+                except requests.exceptions.HTTPError:
+                    pass  # no /embed/ on the backend
+            if data is None and not dry:
+                # render the answer token by token; falls back to the
+                # buffered request below on older backends (404)
+                stream_box = st.empty()
+                try:
+                    data = stream_query(payload, stream_box, start_ts)
+                except requests.exceptions.HTTPError as e:
+                    data = error_data(e.response)
+                finally:
+                    stream_box.empty()
+
+            if data is None:
+                if dry:
+                    try:
+                        payload["embedding"] = embed(q_clean)
+                    except requests.exceptions.HTTPError:
+                        pass  # no /embed/ on the backend: send the text only
+                # send POST request to Django Query API, choose endpoint by 'dry' flag
+                url = URL_BY_MODE[dry]
+                payload_items = tuple(sorted(payload.items()))
+                try:
+                    data = (_post_query if bypass_cache else run_query)(
+                        url, payload_items
                     )
-
-            elif response.status_code != 200:
-                st.error(
-                    f"API Request Failed. Status: {response.status_code}. Detail: {response.text}"
-                )
-                st.stop()
+                except requests.exceptions.HTTPError as e:
+                    data = error_data(e.response)
 
             # success or after LLM failure 500 fallback
-            data = response.json() if response.status_code == 200 else data
             res = {
                 "answer": data.get("answer", ""),
-                "hits": data.get("sources", []) or data.get("hits", []),
-                "used": data.get("used", {}),
+                "hits": data.get("sources") or data.get("hits") or [],
+                "used": data.get("used") or {},
             }
             elapsed_ms = round((time.time() - start_ts) * 1000, 1)  # timing ends
-
-            # display results
-            st.markdown("---")
-            st.markdown("### Generated Answer")
-            st.caption(f"Answer latency: {elapsed_ms} ms")
-            answer_text = res.get("answer", "No answer provided.")
-            # to show full answer of long text, preventing trucations by Markdown
-            st.text_area(
-                "Full Answer Output",
-                value=answer_text,
-                height=300,
-                disabled=True,
-                key="answer_box",
-            )
-
-            if show_retrieval:
-                st.markdown("### Retrieval Sources")
-                hits = res.get("hits", [])
-                if hits:
-                    for i, h in enumerate(hits, start=1):
-                        meta = h.get("meta", {})
-                        distance_str = (
-                            f"Distance={h.get('distance',None):.4f}"
-                            if h.get("distance") is not None
-                            else ""
-                        )
-                        st.write(
-                            f"**[{i}]** **Document:** {meta.get('doc_id','?')} • **Chunk Index:** {meta.get('chunk_idx','?')} • {distance_str}"
-                        )
-                        with st.expander(f"View Chunk {i} Content"):
-                            st.code(h.get("text", "N/A"), language="text")
-                else:
-                    st.warning("No relevant sources retrieved.")
+            if (
+                sem_vec is not None
+                and "sem_sim" not in data
+                and data.get("status", "success") == "success"
+                and res["answer"]
+                and "[ERROR]" not in res["answer"]
+            ):
+                sem_cache_store(sem_vec, sem_params, dict(data, first_token_ms=None))
+
+            first_token_ms = data.get("first_token_ms")
+            if first_token_ms is not None:
+                latency = f"Answer latency: {elapsed_ms} ms • first token: {first_token_ms} ms"
+            elif "sem_sim" in data:
+                latency = f"Answer latency: {elapsed_ms} ms • semantic cache hit (cos={data['sem_sim']})"
+            else:
+                latency = f"Answer latency: {elapsed_ms} ms"
+            # kept across reruns, so inspecting a chunk doesn't drop the answer
+            st.session_state["last_result"] = {"res": res, "latency": latency}
+            st.session_state.pop("answer_box", None)
+            st.session_state.pop("inspect_chunk", None)
 
     except requests.exceptions.ConnectionError:
         st.error(
@@ -338,3 +622,71 @@ if run_btn and q.strip():
         )
     except Exception as e:
         st.error(f"An unexpected error occurred: {e}")
+
+
+# display results
+last = st.session_state.get("last_result")
+if last:
+    res = last["res"]
+    st.markdown("---")
+    st.markdown("### Generated Answer")
+    st.caption(last["latency"])
+    answer_text = res.get("answer", "No answer provided.")
+    # to show full answer of long text, preventing trucations by Markdown
+    st.text_area(
+        "Full Answer Output",
+        value=answer_text,
+        height=300,
+        disabled=True,
+        key="answer_box",
+    )
+
+    if show_retrieval:
+        st.markdown("### Retrieval Sources")
+        hits = res.get("hits", [])
+        if hits:
+            # one table plus one code block, instead of a write + expander +
+            # code widget per hit
+            rows = [
+                {
+                    "#": i,
+                    "doc": (h.get("meta") or {}).get("doc_id", "?"),
+                    "chunk": (h.get("meta") or {}).get("chunk_idx", "?"),
+                    "dist": h.get("distance"),
+                    "preview": h.get("text", "")[:200],
+                }
+                for i, h in enumerate(hits, start=1)
+            ]
+            st.dataframe(
+                rows,
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "dist": st.column_config.NumberColumn(format="%.4f"),
+                    "preview": st.column_config.TextColumn(width="large"),
+                },
+            )
+            pick = st.selectbox(
+                "Inspect chunk", range(1, len(hits) + 1), key="inspect_chunk"
+            )
+            st.code(hits[pick - 1].get("text", "N/A"), language="text")
+        else:
+            st.warning("No relevant sources retrieved.")
+
+
+# health badge last: by now the probe started at the top has had the whole
+# page render to complete
+with colA:
+    health_fragment()
+
+
+# deferred rerun (e.g. after ingest): ticks only while one is pending
+@st.fragment(run_every=0.5 if st.session_state.get("pending_rerun_at") else None)
+def _maybe_rerun():
+    t = st.session_state.get("pending_rerun_at")
+    if t and time.time() >= t:
+        st.session_state.pop("pending_rerun_at")
+        st.rerun()
+
+
+_maybe_rerun()